@@ -551,6 +551,10 @@ void Uniform(const SType low, const SType high, Tensor *out);
 template <typename SType>
 void Axpy(SType alpha, const Tensor &in, Tensor *out);
 
+/// out = alpha*in + beta*out; 'out' is not read if beta is 0
+template <typename SType>
+void Axpby(SType alpha, const Tensor &in, SType beta, Tensor *out);
+
 /// Do matrix vector multipication or matrix matrix multiplication depdending
 /// on the Tensor shape.  result = A * B
 Tensor Mult(const Tensor &A, const Tensor &B);
@@ -563,6 +567,32 @@ template <typename SType>
 void Mult(const SType alpha, const Tensor &A, const Tensor &B, const SType beta,
           Tensor *C);
 
+// ================Optimizer operations=======================================
+/// Update 'param' by SGD with momentum, visiting each element only once.
+///   g = grad + weight_decay * param
+///   buf = first_step ? g : momentum * buf + (1 - dampening) * g
+///   g = nesterov ? g + momentum * buf : buf
+///   param = param - lr * g
+/// 'buf' is neither read nor written if momentum is 0; it is not read at the
+/// first step, hence it need not be initialized. 'grad' is unchanged.
+template <typename SType>
+void FusedSGDUpdate(Tensor *param, const Tensor &grad, Tensor *buf,
+                    const SType lr, const SType momentum,
+                    const SType dampening, const SType weight_decay,
+                    const bool nesterov, const bool first_step);
+/// Apply FusedSGDUpdate to every (params[i], grads[i], bufs[i]) with the
+/// hyper-parameters lrs[i], momenta[i], dampenings[i] and weight_decays[i].
+/// All tensors must be on the same device and of the same data type. The Cuda
+/// implementation updates all tensors using a single kernel launch (per chunk
+/// of tensors). bufs[i] is not accessed if momenta[i] is 0.
+template <typename SType>
+void MultiTensorSGD(vector<Tensor> &params, const vector<Tensor> &grads,
+                    vector<Tensor> &bufs, const vector<SType> &lrs,
+                    const vector<SType> &momenta,
+                    const vector<SType> &dampenings,
+                    const vector<SType> &weight_decays, const bool nesterov,
+                    const bool first_step);
+
 // *****************
 // Misc.
 // ****************
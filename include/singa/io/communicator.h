@@ -79,20 +79,69 @@ public:
   cudaStream_t c1;
   cudaStream_t c2;
   ncclComm_t comm;
+  // with hierarchical all-reduce, intraComm connects the GPUs of a node and
+  // interComm connects the GPUs of the same local rank across the nodes
+  bool hierarchical;
+  int localSize;
+  ncclComm_t intraComm;
+  ncclComm_t interComm;
   cudaEvent_t event;
-
-  Communicator(int limit);
+  // syncEvents[i] is recorded when the result of the i-th synch call since
+  // the last wait() is ready
+  vector<cudaEvent_t> syncEvents;
+  int numSyncs;
+  // the synch calls between groupStart() and groupEnd() are one nccl group;
+  // their events are recorded by groupEnd() from index groupBegin
+  bool inGroup;
+  int groupBegin;
+  // the grouped synch calls to scale after their all-reduce in groupEnd(),
+  // if the scale is not done by nccl
+  vector<Tensor> groupTensors;
+  vector<float> groupScales;
+  // the device scalar for the sum of the absolute values to compress
+  float *signScale;
+  // the device flag set by the half precision synch calls if a sum is inf
+  // or nan, e.g., as the loss scale is too large
+  int *halfOverflow;
+
+  Communicator(int limit, bool hierarchical = false);
   Communicator(int gpu_num, int gpu_per_node, const NcclIdHolder &holder, int size);
   ~Communicator();
-  void synch(Tensor &t);
-  void fusedSynch(vector<Tensor> &t);
-  void synchHalf(Tensor &t);
-  void fusedSynchHalf(vector<Tensor> &t);
+  // the synch functions return the index of the call for waitFor(); the
+  // all-reduced sum is multiplied by scale when it is copied back to the
+  // tensors, e.g., 1 / totalMPIRanksInGlobal to average the gradients
+  int synch(Tensor &t, float scale = 1.0f);
+  int fusedSynch(vector<Tensor> &t, float scale = 1.0f);
+  // the half precision synch calls multiply the tensors by lossScale before
+  // the conversion to half precision and divide the sum by it afterwards
+  int synchHalf(Tensor &t, float scale = 1.0f, float lossScale = 1.0f);
+  int fusedSynchHalf(vector<Tensor> &t, float scale = 1.0f,
+                     float lossScale = 1.0f);
+  // whether a half precision synch call since the last check has produced
+  // inf or nan; it waits for the calls and resets the flag
+  bool overflow();
+  // all-reduce the signs of the gradients (plus the residuals) in int8 and
+  // one scale, i.e., 1-bit compression with error feedback; the residual
+  // holds the compression error of the tensors (fused in order), which is
+  // kept by the caller across the iterations
+  int synchSign(Tensor &t, Tensor &residual, float scale = 1.0f);
+  int fusedSynchSign(vector<Tensor> &t, Tensor &residual, float scale = 1.0f);
   void wait();
+  void waitFor(int idx);
+  // group the following synch calls into one launch of nccl, which is not
+  // supported by the other synch functions as they reuse the fused and the
+  // half precision buffers, i.e., the grouped calls would need a buffer each
+  void groupStart();
+  void groupEnd();
 
 private:
-  void allReduce(int size, void* sendbuff, void* recvbuff, ncclDataType_t ncclType);
+  void allReduce(int size, void* sendbuff, void* recvbuff, ncclDataType_t ncclType,
+                 ncclRedOp_t op = ncclSum);
+  int recordSync(cudaStream_t stream);
+  void signAllReduce(size_t size, float* data, Tensor &residual, float scale);
+  void waitHalfBuffers();
   void setup(int gpu_num);
+  void setupHierarchical(const uint64_t *hostHashs);
 
 };
 
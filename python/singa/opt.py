@@ -18,10 +18,18 @@
 '''This module includes a set of optimizers for updating model parameters.
 It replaces the old optimizers from optimizer.py'''
 
+import os
+import warnings
+import numpy as np
+
 from singa import tensor
 from singa import autograd
 from . import singa_wrap as singa
 
+# (NCCL_MIN_NCHANNELS,) of the first communicator, as nccl reads it once per
+# process; None if no communicator has been created
+_nccl_min_nchannels = None
+
 
 class Optimizer(object):
     r"""Base optimizer.
@@ -46,6 +54,29 @@ class Optimizer(object):
         """
         pass
 
+    def multi_update(self, params, grads, grad_scale=1.0):
+        r"""Update a list of params with their gradients.
+
+        Args:
+            params(List[Tensor]): param values to be updated in-place
+            grads(List[Tensor]): param gradients in the same order as params;
+                    the values may be updated in this function
+            grad_scale(float): the gradients are multiplied by it before
+                    the update, e.g., to average the all-reduced gradients
+        """
+        for p, g in zip(params, grads):
+            if grad_scale != 1.0:
+                g *= grad_scale
+            self.update(p, g)
+
+    def backward_and_update(self, loss):
+        params = []
+        grads = []
+        for p, g in autograd.backward(loss):
+            params.append(p)
+            grads.append(g)
+        self.multi_update(params, grads)
+
     def step(self):
         r"""To increment the step counter"""
         self.iter += 1
@@ -120,6 +151,8 @@ class SGD(Optimizer):
             raise ValueError(
                 "Nesterov momentum requires a momentum and zero dampening")
         super(SGD, self).__init__(defaults)
+        # the cached grouping of multi_update per tuple of param ids
+        self._plans = {}
 
     def update(self, param, grad):
         """Performs a single optimization step.
@@ -129,8 +162,6 @@ class SGD(Optimizer):
                 grad(Tensor): param gradients; the values may be updated
                         in this function; cannot use it anymore
         """
-        assert param.shape == grad.shape, ("shape mismatch",
-                                           param.shape, grad.shape)
         group = self.default_config
         if param in self.param2config:
             group = self.param2config[param]
@@ -139,35 +170,189 @@ class SGD(Optimizer):
         dampening = group['dampening']
         nesterov = group['nesterov']
 
-        if weight_decay != 0:
-            singa.Axpy(weight_decay, param.data, grad.data)
+        param_state = self._check_grad(param, grad)
+        # the buffer is not accessed by the fused update if momentum is 0
+        buf, first_step = param, False
         if momentum != 0:
-            if param not in self.param2state:
-                self.param2state[param] = {}
-            param_state = self.param2state[param]
+            buf, first_step = self._momentum_buffer(param, param_state)
+        singa.FusedSGDUpdate(param.data, grad.data, buf.data, group['lr'],
+                             momentum, dampening, weight_decay, nesterov,
+                             first_step)
+
+    def init_state(self, params):
+        """Allocates the momentum buffers of params before the first step.
+
+        The buffers are not initialized, since the first step sets them to the
+        gradients without reading them. Params without a buffer get it in
+        their first step. A buffer follows its param if the param is moved to
+        another device before its first step, e.g., by the first forward
+        propagation.
+
+        Arguments:
+                params(List[Tensor]): params using momentum
+        """
+        for param in params:
+            param_state = self.param2state.setdefault(param, {})
             if 'momentum_buffer' not in param_state:
-                buf = param_state[
-                    'momentum_buffer'] = tensor.zeros_like(param)
-                buf *= momentum
-                singa.Axpy(1.0, grad.data, buf.data)
-            else:
-                buf = param_state['momentum_buffer']
-                buf *= momentum
-                singa.Axpy(1.0 - dampening, grad.data, buf.data)
-            if nesterov:
-                singa.Axpy(momentum, buf.data, grad.data)
-            else:
-                grad = buf
-        singa.Axpy(-group['lr'], grad.data, param.data)
+                param_state['momentum_buffer'] = tensor.empty_like(param)
+                param_state['first_step'] = True
 
-    def backward_and_update(self, loss):
-        for p, g in autograd.backward(loss):
-            self.update(p, g)
+    def _check_grad(self, param, grad):
+        """Checks the shape of the first gradient of param, which is fixed
+        afterwards, and returns the state of param. The kernels still check
+        the sizes in every step.
+        """
+        param_state = self.param2state.get(param)
+        if param_state is None:
+            param_state = self.param2state[param] = {}
+        if 'checked' not in param_state:
+            assert param.shape == grad.shape, ("shape mismatch",
+                                               param.shape, grad.shape)
+            param_state['checked'] = True
+        return param_state
+
+    def _momentum_buffer(self, param, param_state):
+        """Returns the momentum buffer of param and whether this is its first
+        step, which does not read the buffer.
+        """
+        if 'momentum_buffer' not in param_state:
+            self.init_state([param])
+        buf = param_state['momentum_buffer']
+        if param_state['first_step']:
+            # the device is fixed after the first step, hence it is checked
+            # once; the kernels still check the devices in every step
+            param_state['first_step'] = False
+            if buf.device.id() != param.device.id():
+                # the buffer is not read in the first step, hence re-allocated
+                buf = tensor.empty_like(param)
+                param_state['momentum_buffer'] = buf
+            return buf, True
+        return buf, False
+
+    def clear_plans(self):
+        """Clears the cached grouping of multi_update, which holds the params
+        and their momentum buffers, e.g., when a model is discarded.
+        """
+        self._plans = {}
+
+    def register(self, param_group, config):
+        super(SGD, self).register(param_group, config)
+        # the cached plans may have grouped these params by the default config
+        self.clear_plans()
+        if config['momentum'] != 0:
+            self.init_state(param_group)
+
+    def multi_update(self, params, grads, grad_scale=1.0):
+        """Performs a single optimization step for a list of params.
+
+        The float32 params on the same device are updated together by one
+        multi-tensor kernel, which takes the hyper-parameters per param. Params
+        of other data types are updated one by one. Once all the momentum
+        buffers exist, the grouping of the params is cached, so that later
+        steps only collect the params, the buffers, the grads and the
+        hyper-parameters. The params and buffers are collected in every step,
+        as moving a param to another device, e.g., by a forward pass on
+        another device, replaces its block. The cache holds the params until
+        clear_plans() is called.
+
+        Arguments:
+                params(List[Tensor]): param values to be update in-place
+                grads(List[Tensor]): param gradients in the same order as
+                        params; cannot use them anymore
+                grad_scale(float): the gradients are multiplied by it before
+                        the update, which takes one pass over the gradients
+        """
+        if grad_scale != 1.0:
+            for g in grads:
+                g *= grad_scale
+        key = tuple(id(p) for p in params)
+        entry = self._plans.get(key)
+        if entry is not None and self._layout(entry[3]) == entry[4]:
+            _, plan, others, _, _ = entry
+        else:
+            plan, others = self._plan(params, grads)
+            if not any(group[3] for group in plan):
+                # the cache holds the params, so that their ids are not reused;
+                # the plan is rebuilt if the momentum is switched on or off or
+                # nesterov is changed, which fix the buffers and the groups
+                configs = [c for group in plan for c in group[0]]
+                self._plans[key] = (tuple(params), plan, others, configs,
+                                    self._layout(configs))
+        for i in others:
+            self.update(params[i], grads[i])
+        for configs, config_ids, nesterov, first_step, indices, plist, blist, hyper in plan:
+            vparams = singa.VecTensor([p.data for p in plist])
+            vbufs = singa.VecTensor([b.data for b in blist])
+            vgrads = singa.VecTensor([grads[i].data for i in indices])
+            self._foreach_sgd(vparams, vgrads, vbufs, configs, config_ids,
+                              nesterov, first_step, hyper)
+
+    def _layout(self, configs):
+        return tuple((c['momentum'] != 0, c['nesterov']) for c in configs)
+
+    def _plan(self, params, grads):
+        """Groups the params for multi_update.
+
+        Returns:
+            a list of (configs, config index per param, nesterov, first_step,
+            param indices, params, momentum buffers, cache of the per-param
+            hyper-parameters) per group, and the indices
+            of the params to update one by one
+        """
+        groups = {}
+        others = []
+        for i, param in enumerate(params):
+            config = self.param2config.get(param, self.default_config)
+            if param.dtype != tensor.float32:
+                others.append(i)
+                continue
+            param_state = self._check_grad(param, grads[i])
+            buf, first_step = param, False
+            if config['momentum'] != 0:
+                buf, first_step = self._momentum_buffer(param, param_state)
+            key = (param.device.id(), config['nesterov'], first_step)
+            if key not in groups:
+                groups[key] = ([], [], [], [], [])
+            configs, config_ids, indices, plist, blist = groups[key]
+            for j, c in enumerate(configs):
+                if c is config:
+                    break
+            else:
+                j = len(configs)
+                configs.append(config)
+            config_ids.append(j)
+            indices.append(i)
+            plist.append(param)
+            blist.append(buf)
+        plan = [(configs, np.array(config_ids), nesterov, first_step, indices,
+                 plist, blist, {})
+                for (_, nesterov, first_step), (configs, config_ids, indices,
+                                                plist, blist) in groups.items()]
+        return plan, others
+
+    def _foreach_sgd(self, params, grads, bufs, configs, config_ids, nesterov,
+                     first_step, hyper=None):
+        # the hyper-parameters are read from the configs in every step, which
+        # may be changed, e.g., by learning rate scheduling; the per-param
+        # vectors of (lr, momentum, dampening, weight_decay) are cached in
+        # hyper and only rebuilt when a value of the configs changes
+        if hyper is None:
+            hyper = {}
+        key = tuple((c['lr'], c['momentum'], c['dampening'], c['weight_decay'])
+                    for c in configs)
+        if hyper.get('key') != key:
+            rows = np.array([[c['lr'], c['momentum'], c['dampening'],
+                              c['weight_decay']] for c in configs])[config_ids]
+            hyper['key'] = key
+            hyper['vecs'] = [singa.VecFloat(col.tolist()) for col in rows.T]
+        lrs, momenta, dampenings, weight_decays = hyper['vecs']
+        singa.MultiTensorSGD(params, grads, bufs, lrs, momenta, dampenings,
+                             weight_decays, nesterov, first_step)
 
 
 class DistOpt(object):
 
-    def __init__(self, opt=SGD(), nccl_id=None, gpu_num=None, gpu_per_node=None, buffSize=4194304):
+    def __init__(self, opt=SGD(), nccl_id=None, gpu_num=None, gpu_per_node=None, buffSize=4194304, algo='auto', hierarchical=False, nchannels=None, compression=None, loss_scale=1024.0):
         # The class is designed to wrap an optimizer to do disttributed training.
         # opt: The optimizer to be wrapped. nDev: number of devices(GPUs) a
         # process will control/use.
@@ -175,143 +360,419 @@ class DistOpt(object):
         # gpu_num: the GPU id in a single node
         # gpu_per_node: the number of GPUs in a single node
         # buffSize: the buffSize used in nccl communicator, default is 16 MB
+        # algo: the nccl all-reduce algorithm, 'ring', 'tree' or 'auto'; with
+        # 'auto' nccl picks the algorithm per message size, i.e. tree for the
+        # small fused buckets and ring for the large tensors
+        # hierarchical: all-reduce within the nodes first, and then across the
+        # nodes via one GPU per local rank, only for application using MPI
+        # nchannels: the minimum number of nccl channels (parallel rings), which
+        # lets a large all-reduce use all the NICs and NVLinks of a node; it is
+        # a process-wide setting fixed by the first DistOpt
+        # compression: None, or '1bit' to all-reduce only the signs of the
+        # gradients (as int8) and a scale per bucket (per chunk of the
+        # communicator buffer for larger tensors); the compression error is
+        # fed back into the gradients of the same bucket in the next iteration
+        # loss_scale: the initial scale of the float16 all-reduce; the float32
+        # gradients are multiplied by it before the conversion to float16, so
+        # that the small values do not become zero, and the sums are divided
+        # by it afterwards; the default keeps the sums of gradients up to
+        # 64 / world_size in range; a step whose sums overflow is skipped with
+        # a warning and halves the scale, which is doubled after 2000 steps
+        # without overflow; None disables the scaling and the overflow check
 
         # world_size: total number of processes.
         # rank_in_local: local rank of a process on the current node.
         # rank_in_global: global rank of a process
 
         self.opt = opt
-        if nccl_id is None:
-            # constructure for application using MPI
-            self.communicator = singa.Communicator(buffSize)
-        else:
-            # constructor for application using python multi-process module
-            self.communicator = singa.Communicator(gpu_num, gpu_per_node, nccl_id, buffSize)
+        if compression not in (None, '1bit'):
+            raise ValueError("Invalid compression: {}".format(compression))
+        self.compression = compression
+        if algo not in ('auto', 'ring', 'tree'):
+            raise ValueError("Invalid all-reduce algorithm: {}".format(algo))
+        if hierarchical and nccl_id is not None:
+            raise ValueError("Hierarchical all-reduce requires MPI, i.e., "
+                             "nccl_id must be None")
+        # nccl reads the settings from the environment when the communicator
+        # is created, after which the previous values are restored
+        env = {}
+        if algo != 'auto':
+            env['NCCL_ALGO'] = algo.capitalize()
+        if nchannels is not None:
+            env['NCCL_MIN_NCHANNELS'] = str(nchannels)
+        saved = {k: os.environ.get(k) for k in env}
+        os.environ.update(env)
+        global _nccl_min_nchannels
+        min_nchannels = os.environ.get('NCCL_MIN_NCHANNELS')
+        if _nccl_min_nchannels is None:
+            _nccl_min_nchannels = (min_nchannels,)
+        elif _nccl_min_nchannels != (min_nchannels,):
+            warnings.warn("NCCL_MIN_NCHANNELS is fixed to {} by the first "
+                          "DistOpt of the process, hence {} is "
+                          "ignored".format(_nccl_min_nchannels[0] or "default",
+                                           min_nchannels or "default"))
+        try:
+            if nccl_id is None:
+                # constructure for application using MPI
+                self.communicator = singa.Communicator(buffSize, hierarchical)
+            else:
+                # constructor for application using python multi-process module
+                self.communicator = singa.Communicator(gpu_num, gpu_per_node, nccl_id, buffSize)
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    del os.environ[k]
+                else:
+                    os.environ[k] = v
 
         self.world_size = self.communicator.totalMPIRanksInGlobal
+        if compression == '1bit' and self.world_size > 127:
+            # the int8 signs are summed over all the ranks without overflow
+            raise ValueError("1bit compression supports at most 127 ranks, "
+                             "got {}".format(self.world_size))
+        # gradients summed locally over the steps of gradient accumulation
+        self._accum = {}
+        self._accum_step = 0
+        # the residuals of the 1-bit compression per bucket as (params,
+        # residual), keyed by the ids of the params of the bucket
+        self._residuals = {}
+        # the cached partitions of backward_and_partial_update and the
+        # threshold they are built with
+        self._partitions = None
+        self._partition_threshold = None
+        # the dynamic loss scale of the float16 all-reduce and the number of
+        # steps since its last change
+        self.loss_scale = loss_scale
+        self._loss_scale_steps = 0
         self.rank_in_local = self.communicator.MPIRankInLocal
         self.rank_in_global = self.communicator.MPIRankInGlobal
 
+    # kept for the callers which all-reduce the gradients themselves with the
+    # default scale of 1, i.e., the sum; the update functions of DistOpt
+    # average the gradients in the all-reduce instead
     def update(self, param, grad):
         grad /= self.world_size
         self.opt.update(param, grad)
 
-    def all_reduce(self, tensor):
-        self.communicator.synch(tensor)
-
-    def fused_all_reduce(self, tensor):
-        tensor = singa.VecTensor(tensor)
-        self.communicator.fusedSynch(tensor)
-
-    def all_reduce_half(self, tensor):
-        self.communicator.synchHalf(tensor)
-
-    def fused_all_reduce_half(self, tensor):
-        tensor = singa.VecTensor(tensor)
-        self.communicator.fusedSynchHalf(tensor)
+    def multi_update(self, params, grads):
+        self.opt.multi_update(params, grads, 1.0 / self.world_size)
+
+    # the all-reduce functions return the index of the call for wait_for()
+    # scale: the sum is multiplied by it when it is copied back to the tensors,
+    # e.g., 1 / world_size to average the gradients without another pass
+    def all_reduce(self, tensor, scale = 1.0):
+        return self.communicator.synch(tensor, scale)
+
+    # the VecTensor of the tensors is built in every call, as it copies the
+    # tensors, whose blocks are replaced if they are moved to another device
+    def fused_all_reduce(self, tensors, scale = 1.0):
+        return self.communicator.fusedSynch(singa.VecTensor(tensors), scale)
+
+    # loss_scale: the tensors are multiplied by it before the conversion to
+    # float16, and the sum is divided by it; overflow() tells whether a sum
+    # has become inf or nan
+    def all_reduce_half(self, tensor, scale = 1.0, loss_scale = 1.0):
+        return self.communicator.synchHalf(tensor, scale, loss_scale)
+
+    def fused_all_reduce_half(self, tensors, scale = 1.0, loss_scale = 1.0):
+        return self.communicator.fusedSynchHalf(singa.VecTensor(tensors),
+                                                scale, loss_scale)
+
+    def overflow(self):
+        # wait for the float16 all-reduces and check them for inf or nan
+        return self.communicator.overflow()
+
+    # residual: the compression error of the tensors (fused in order), which
+    # is added to them before the compression and updated in place
+    def all_reduce_sign(self, tensor, residual, scale = 1.0):
+        return self.communicator.synchSign(tensor, residual, scale)
+
+    def fused_all_reduce_sign(self, tensors, residual, scale = 1.0):
+        return self.communicator.fusedSynchSign(singa.VecTensor(tensors),
+                                                residual, scale)
+
+    # the bucket reductions of backward_and_update, which average the
+    # gradients in the all-reduce, so that the update gets the mean gradients
+    # and the momentum buffers keep their meaning
+    def _reduce_float(self, params, tensors, fused):
+        if fused:
+            return self.fused_all_reduce(tensors, scale=1.0 / self.world_size)
+        return self.all_reduce(tensors[0], 1.0 / self.world_size)
+
+    def _reduce_half(self, params, tensors, fused):
+        loss_scale = 1.0 if self.loss_scale is None else self.loss_scale
+        if fused:
+            return self.fused_all_reduce_half(tensors,
+                                              scale=1.0 / self.world_size,
+                                              loss_scale=loss_scale)
+        return self.all_reduce_half(tensors[0], 1.0 / self.world_size,
+                                    loss_scale)
+
+    def _reduce_sign(self, params, tensors, fused):
+        residual = self._residual(params)
+        if fused:
+            return self.fused_all_reduce_sign(tensors, residual.data,
+                                              scale=1.0 / self.world_size)
+        return self.all_reduce_sign(tensors[0], residual.data,
+                                    1.0 / self.world_size)
+
+    def _residual(self, params):
+        # the residual of the bucket of params, which starts from zero
+        key = tuple(id(p) for p in params)
+        if key not in self._residuals:
+            residual = tensor.Tensor((sum(p.size() for p in params),),
+                                     params[0].device)
+            residual.set_value(0.0)
+            # the entry holds the params, so that their ids are not reused
+            self._residuals[key] = (tuple(params), residual)
+        return self._residuals[key][1]
+
+    def _drop_residuals(self, buckets):
+        # the residuals of the buckets that are gone, e.g., as the threshold
+        # or the params with gradients have changed, are dropped, so that
+        # a changed layout starts from zero residuals
+        keys = set(tuple(id(p) for p in params) for _, params, _ in buckets)
+        self._residuals = {k: v for k, v in self._residuals.items()
+                           if k in keys}
 
     def wait(self):
         self.communicator.wait()
 
-    def backward_and_update(self, loss, threshold = 2097152):
-        # backward propagation from the loss and parameter update
+    def wait_for(self, idx):
+        # wait only for the result of the idx-th all-reduce call
+        self.communicator.waitFor(idx)
+
+    # the all_reduce calls between group_start() and group_end() are launched
+    # together by nccl; the other all-reduce functions cannot be grouped, as
+    # they share the fused and the half precision buffers
+    def group_start(self):
+        self.communicator.groupStart()
+
+    def group_end(self):
+        self.communicator.groupEnd()
+
+    def _update_buckets(self, buckets):
+        # each bucket waits for its own all-reduce only, so that the update of
+        # a bucket overlaps with the all-reduce of the buckets issued after it
+        # the gradients are averaged by the all-reduce
+        for idx, params, grads in buckets:
+            self.wait_for(idx)
+            self.opt.multi_update(params, grads)
+        self.wait()
+
+    def _update_buckets_scaled(self, buckets):
+        # with loss scaling the step is skipped if any float16 sum overflows,
+        # hence the updates wait for all the all-reduces
+        self.wait()
+        if self.overflow():
+            self.loss_scale = max(self.loss_scale / 2, 1.0)
+            self._loss_scale_steps = 0
+            warnings.warn("Skipped the update as the float16 all-reduce "
+                          "overflowed; the loss scale is reduced to "
+                          "{}".format(self.loss_scale))
+            return
+        for _, params, grads in buckets:
+            self.opt.multi_update(params, grads)
+        self._loss_scale_steps += 1
+        if self._loss_scale_steps == 2000:
+            self.loss_scale *= 2
+            self._loss_scale_steps = 0
+
+    def _reduce_buckets(self, grads, threshold, first_threshold, reduce, group = False):
+        # all-reduce the gradients of the (param, grad) pairs bucket by bucket
+        # and return the buckets as (index of the all-reduce call, params, grads)
+        # reduce(params, tensors, fused) all-reduces and averages a bucket
         # it applies tensor fusion which fuses all the tensor smaller than the threshold value
+        # the backward propagation yields the gradients from the output layer
+        # to the input layer, and the all-reduce of a bucket is issued as soon
+        # as it is full, overlapping with the backward of the remaining layers;
+        # the first bucket is capped by first_threshold to start it earlier
+        # group: the consecutive gradients larger than threshold are reduced
+        # in one nccl group, which is closed by the next smaller gradient, so
+        # that the reduction does not wait for the next fused bucket; only the
+        # float32 all-reduce is grouped
+        buckets = []
         plist = []
+        gradlist = []
         acc = 0
         glist = []
-        for p, g in autograd.backward(loss):
+        limit = min(first_threshold, threshold)
+        grouped = False
+        for p, g in grads:
             if g.size() > threshold:
                 # larger than threshold -> reduced directly
-                self.all_reduce(g.data)
+                if group and not grouped:
+                    self.group_start()
+                    grouped = True
+                buckets.append((reduce([p], [g.data], False), [p], [g]))
             else:
+                if grouped:
+                    self.group_end()
+                    grouped = False
                 # smaller than threshold -> accumulate
-                glist.append(g.data)                    
+                glist.append(g.data)
+                plist.append(p)
+                gradlist.append(g)
                 acc += g.size()
-                if (acc > threshold):
-                    self.fused_all_reduce(glist)
+                if (acc > limit):
+                    buckets.append((reduce(plist, glist, True), plist, gradlist))
+                    limit = threshold
                     acc = 0
                     glist = []
-            plist.append((p, g))
+                    plist = []
+                    gradlist = []
+        if grouped:
+            self.group_end()
         if glist:
-            self.fused_all_reduce(glist)
-        self.wait()
-        for p, g in plist:
-            self.update(p, g)  
+            buckets.append((reduce(plist, glist, True), plist, gradlist))
+        return buckets
+
+    def _accumulate(self, grads):
+        # sum the gradients locally without all-reduce
+        for p, g in grads:
+            if p in self._accum:
+                tensor.axpy(1.0, g, self._accum[p])
+            else:
+                self._accum[p] = g.clone()
+
+    def _accumulated(self, grads, accumulate_steps):
+        # yield the gradients averaged over the steps of gradient accumulation
+        scale = 1.0 / accumulate_steps
+        for p, g in grads:
+            acc = self._accum.pop(p, None)
+            if acc is None:
+                g /= accumulate_steps
+                yield p, g
+            else:
+                tensor.axpby(scale, g, scale, acc)
+                yield p, acc
+        # the params without gradient in the last step
+        for p, acc in self._accum.items():
+            acc /= accumulate_steps
+            yield p, acc
+        self._accum = {}
+
+    def backward_and_update(self, loss, threshold = 2097152, dtype = tensor.float32, first_threshold = 262144, accumulate_steps = 1):
+        # backward propagation from the loss and parameter update
+        # dtype is the precision of the gradients during all-reduce; float16
+        # halves the communication while the params and updates stay float32;
+        # the gradients are scaled by the loss_scale of DistOpt, and the steps
+        # whose float16 sums overflow are skipped; as the overflow is checked
+        # on the host, the float16 updates wait for all the all-reduces
+        # instead of overlapping with them, hence float32 is the default;
+        # it is ignored if the gradients are compressed
+        # accumulate_steps: the gradients are summed locally over this number
+        # of calls, and only the last one does the all-reduce and the update
+        if self.compression == '1bit':
+            reduce = self._reduce_sign
+        elif dtype == tensor.float16:
+            reduce = self._reduce_half
+        elif dtype == tensor.float32:
+            reduce = self._reduce_float
+        else:
+            raise ValueError("Invalid all-reduce dtype: {}".format(dtype))
+        grads = autograd.backward(loss)
+        if accumulate_steps > 1:
+            self._accum_step += 1
+            if self._accum_step < accumulate_steps:
+                self._accumulate(grads)
+                return
+            self._accum_step = 0
+            grads = self._accumulated(grads, accumulate_steps)
+        # only the float32 all-reduce works in place without the fused or the
+        # half precision buffers, so that its calls can be grouped
+        buckets = self._reduce_buckets(grads, threshold, first_threshold,
+                                       reduce,
+                                       group=(reduce == self._reduce_float))
+        if reduce == self._reduce_sign:
+            self._drop_residuals(buckets)
+        if reduce == self._reduce_half and self.loss_scale is not None:
+            self._update_buckets_scaled(buckets)
+        else:
+            self._update_buckets(buckets)
 
-    def backward_and_update_half(self, loss, threshold = 2097152, clipping = False, clip_Value = 100):
+    def backward_and_update_half(self, loss, threshold = 2097152, clipping = False, clip_Value = 100, first_threshold = 262144):
         # THIS IS A EXPERIMENTAL FUNCTION FOR RESEARCH PURPOSE:
         # It converts the gradients to 16 bits half precision format before allreduce
         # To assist training, this functions provide an option to perform gradient clipping
+        grads = autograd.backward(loss)
+        if clipping:
+            grads = ((p, autograd.clip(g, -clip_Value, clip_Value)) for p, g in grads)
+        buckets = self._reduce_buckets(grads, threshold, first_threshold,
+                                       self._reduce_half)
+        if self.loss_scale is not None:
+            self._update_buckets_scaled(buckets)
+        else:
+            self._update_buckets(buckets)
+
+    def _partition(self, params, threshold):
+        # group the params in the order of the backward propagation into the
+        # partitions of backward_and_partial_update as (params, fused)
+        partitions = []
         plist = []
         acc = 0
-        glist = []
-        for p, g in autograd.backward(loss):
-            if clipping:
-                g = autograd.clip(g, -clip_Value, clip_Value)
-            if g.size() > threshold:
+        for p in params:
+            if p.size() > threshold:
                 # larger than threshold -> reduced directly
-                self.all_reduce_half(g.data)
+                partitions.append(([p], False))
             else:
                 # smaller than threshold -> accumulate
-                glist.append(g.data)                    
-                acc += g.size()
+                plist.append(p)
+                acc += p.size()
                 if (acc > threshold):
-                    self.fused_all_reduce_half(glist)
+                    partitions.append((plist, True))
                     acc = 0
-                    glist = []
-            plist.append((p, g))
-        if glist:
-            self.fused_all_reduce_half(glist)
-        self.wait()
-        for p, g in plist:
-            self.update(p, g)  
+                    plist = []
+        if plist:
+            partitions.append((plist, True))
+        return partitions
+
+    def _reduce_partition(self, partition):
+        # the all-reduced parameters are averaged by the all-reduce
+        params, fused = partition
+        if fused:
+            self.fused_all_reduce([p.data for p in params],
+                                  scale = 1.0 / self.world_size)
+        else:
+            self.all_reduce(params[0].data, 1.0 / self.world_size)
 
     def backward_and_partial_update(self, loss, threshold = 2097152):
         # THIS IS A EXPERIMENTAL FUNCTION FOR RESEARCH PURPOSE:
         # It performs asychronous training where one parameter partition is all-reduced per iteration
         # The size of the parameter partition depends on the threshold value
-        # self.partial is the counter to determine which partition to perform all-reduce
+        # self.partial is the index of the partition to perform all-reduce
+        # the partitions are computed in the first call and reused as long as
+        # the threshold stays the same
         if not hasattr(self, "partial"):
             self.partial = 0
-        self.partial += 1
-        k = 0
-        plist = []
-        acc = 0
-        tenlist = []
-        reduced = []
+        cached = self._partition_threshold == threshold
+        if cached:
+            partition = self._partitions[self.partial]
+            members = set(partition[0])
+            pending = len(members)
+        params = []
         for p, g in autograd.backward(loss):
             # every parameters update locally
             self.opt.update(p, g)
-            # then do the partial parameter sychronization
-            if p.size() > threshold:
-                # larger than threshold -> reduced directly
-                # k is the partition number of the full gradient set
-                k += 1
-                if (k == self.partial):
-                    self.all_reduce(p.data)
-                    reduced.append(p)
-            else:
-                # smaller than threshold -> accumulate
-                plist.append(p.data)
-                tenlist.append(p)
-                acc += p.size()
-                if (acc > threshold):
-                    k += 1
-                    if (k == self.partial):
-                        self.fused_all_reduce(plist)
-                        reduced = tenlist
-                    acc = 0
-                    plist = []
-                    tenlist = []
-        if plist:
-            k += 1
-            if (k == self.partial):
-                self.fused_all_reduce(plist)
-                reduced = tenlist
+            # then do the partial parameter sychronization as soon as all the
+            # params of the partition are updated
+            if not cached:
+                params.append(p)
+            elif p in members:
+                pending -= 1
+                if pending == 0:
+                    self._reduce_partition(partition)
+        if not cached:
+            if not params:
+                return
+            self._partitions = self._partition(params, threshold)
+            self._partition_threshold = threshold
+            self.partial = 0
+            partition = self._partitions[0]
+            self._reduce_partition(partition)
+        elif pending > 0:
+            # some params of the partition have no gradient in this call
+            self._reduce_partition(partition)
         self.wait()
-        # the all-reduced parameters needed to be averaged
-        for r in reduced:
-            r /= self.world_size
         # the counter returns to zero after a cycle of partial update
-        if (k == self.partial):
-            self.partial = 0
+        self.partial = (self.partial + 1) % len(self._partitions)
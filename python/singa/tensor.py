@@ -66,6 +66,7 @@ from .device import get_default_device
 
 int32 = core_pb2.kInt
 float32 = core_pb2.kFloat32
+float16 = core_pb2.kFloat16
 CTensor = singa.Tensor
 
 
@@ -604,6 +605,12 @@ def from_raw_tensors(tt):
     return ret
 
 
+def empty_like(t):
+    '''Create a tensor with the same shape, device and data type as t
+    without initializing its values.'''
+    return Tensor(t.shape, t.device, t.dtype)
+
+
 def zeros_like(t):
     ret = Tensor(t.shape, t.device, t.dtype)
     ret.set_value(float(0))
@@ -1386,6 +1393,22 @@ def axpy(alpha, x, y):
     return y
 
 
+def axpby(alpha, x, beta, y):
+    '''Element-wise operation for y = alpha * x + beta * y.
+
+    Args:
+        alpha (float)
+        x (Tensor)
+        beta (float)
+        y (Tensor)
+
+    Returns:
+        y
+    '''
+    singa.Axpby(float(alpha), x.data, float(beta), y.data)
+    return y
+
+
 def bernoulli(p, t):
     '''Generate a binary value for each element of t.
 
@@ -65,6 +65,7 @@ using singa::DataType;
 
 
 %template(Shape) std::vector<size_t>;
+%template(VecFloat) std::vector<float>;
 
 namespace singa{
 
@@ -310,6 +311,10 @@ namespace singa{
   void Axpy(SType alpha, const Tensor &in, Tensor *out);
   %template(Axpy) Axpy<float>;
 
+  template <typename SType>
+  void Axpby(SType alpha, const Tensor &in, SType beta, Tensor *out);
+  %template(Axpby) Axpby<float>;
+
   Tensor Mult(const Tensor &A, const Tensor &B);
   %rename(MultWithRet) Mult(const Tensor &A, const Tensor &B, Tensor *C);
   void Mult(const Tensor &A, const Tensor &B, Tensor *C);
@@ -319,6 +324,26 @@ namespace singa{
   %template(MultWithScale) Mult<float>;
 
 
+  /* =========== Optimizer operations ==========*/
+  template <typename SType>
+  void FusedSGDUpdate(Tensor *param, const Tensor &grad, Tensor *buf,
+                      const SType lr, const SType momentum,
+                      const SType dampening, const SType weight_decay,
+                      const bool nesterov, const bool first_step);
+  %template(FusedSGDUpdate) FusedSGDUpdate<float>;
+
+  template <typename SType>
+  void MultiTensorSGD(std::vector<Tensor> &params,
+                      const std::vector<Tensor> &grads,
+                      std::vector<Tensor> &bufs,
+                      const std::vector<SType> &lrs,
+                      const std::vector<SType> &momenta,
+                      const std::vector<SType> &dampenings,
+                      const std::vector<SType> &weight_decays,
+                      const bool nesterov, const bool first_step);
+  %template(MultiTensorSGD) MultiTensorSGD<float>;
+
+
   /* =========== Matrix operations ==========*/
 
   void AddColumn(const Tensor &v, Tensor *M);
@@ -43,13 +43,21 @@ public:
   int MPIRankInGlobal;
   int totalMPIRanksInGlobal;
   int MPIRankInLocal;
-  Communicator(int limit);
+  Communicator(int limit, bool hierarchical = false);
   Communicator(int gpu_num, int gpu_per_node, const NcclIdHolder &holder, int limit);
-  void synch(Tensor &t);
-  void fusedSynch(std::vector<Tensor> &t);
-  void synchHalf(Tensor &t);
-  void fusedSynchHalf(std::vector<Tensor> &t);
+  int synch(Tensor &t, float scale = 1.0f);
+  int fusedSynch(std::vector<Tensor> &t, float scale = 1.0f);
+  int synchHalf(Tensor &t, float scale = 1.0f, float lossScale = 1.0f);
+  int fusedSynchHalf(std::vector<Tensor> &t, float scale = 1.0f,
+                     float lossScale = 1.0f);
+  bool overflow();
+  int synchSign(Tensor &t, Tensor &residual, float scale = 1.0f);
+  int fusedSynchSign(std::vector<Tensor> &t, Tensor &residual,
+                     float scale = 1.0f);
   void wait();
+  void waitFor(int idx);
+  void groupStart();
+  void groupEnd();
 };
 
 
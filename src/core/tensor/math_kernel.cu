@@ -32,6 +32,13 @@
 #define CU1DBLOCK 1024
 #define CU1DBLOCKF 1024.0
 
+// multi-tensor kernels get the tensor list as a kernel argument (<= 4KB);
+// each thread block processes one chunk of one tensor
+#define MT_MAX_TENSORS 36
+#define MT_MAX_BLOCKS 320
+#define MT_CHUNK_SIZE 65536
+#define MT_BLOCK 512
+
 namespace singa {
 // Cuda Kernel Functions
 namespace cuda {
@@ -381,17 +388,161 @@ __global__ void KernelSoftmaxCrossEntropyBwd(const bool int_target, const size_t
   }
 }
 
-__global__ void KernelFloat2Half(const size_t n, const float *in, __half *out) {
+__global__ void KernelFloat2Half(const size_t n, const float *in,
+                                 const float alpha, __half *out) {
+  for (size_t i = blockIdx.x * blockDim.x + threadIdx.x; i < n;
+       i += blockDim.x * gridDim.x) {
+    out[i] = __float2half_rn(alpha * in[i]);
+  }
+}
+
+__global__ void KernelHalf2Float(const size_t n, const __half *in,
+                                 const float alpha, float *out,
+                                 int *overflow) {
   for (size_t i = blockIdx.x * blockDim.x + threadIdx.x; i < n;
        i += blockDim.x * gridDim.x) {
-    out[i] = __float2half_rn(in[i]);
+    float v = __half2float(in[i]);
+    // all the threads write the same value, hence no atomic is needed
+    if (!isfinite(v)) *overflow = 1;
+    out[i] = alpha * v;
   }
 }
 
-__global__ void KernelHalf2Float(const size_t n, const __half *in, float *out) {
+__global__ void KernelAxpby(const size_t n, const float alpha, const float *in,
+                            const float beta, float *out) {
   for (size_t i = blockIdx.x * blockDim.x + threadIdx.x; i < n;
        i += blockDim.x * gridDim.x) {
-    out[i] = __half2float(in[i]);
+    // out is not read if beta is 0, as in BLAS
+    out[i] = beta == 0 ? alpha * in[i] : alpha * in[i] + beta * out[i];
+  }
+}
+
+// each element of grad, buf and param is visited once
+// buf is not accessed if momentum is 0 and not read at the first step
+__global__ void KernelSGDUpdate(const size_t n, const float lr,
+                                const float momentum, const float dampening,
+                                const float weight_decay, const bool nesterov,
+                                const bool first_step, const float *grad,
+                                float *buf, float *param) {
+  for (size_t i = blockIdx.x * blockDim.x + threadIdx.x; i < n;
+       i += blockDim.x * gridDim.x) {
+    float g = grad[i] + weight_decay * param[i];
+    if (momentum != 0) {
+      float b = first_step ? g : momentum * buf[i] + (1 - dampening) * g;
+      buf[i] = b;
+      g = nesterov ? g + momentum * b : b;
+    }
+    param[i] -= lr * g;
+  }
+}
+
+struct SGDTensorList {
+  const float *grad[MT_MAX_TENSORS];
+  float *buf[MT_MAX_TENSORS];
+  float *param[MT_MAX_TENSORS];
+  size_t size[MT_MAX_TENSORS];
+  float lr[MT_MAX_TENSORS];
+  float momentum[MT_MAX_TENSORS];
+  float dampening[MT_MAX_TENSORS];
+  float weight_decay[MT_MAX_TENSORS];
+  unsigned char block_to_tensor[MT_MAX_BLOCKS];
+  int block_to_chunk[MT_MAX_BLOCKS];
+};
+
+__global__ void KernelMultiTensorSGDUpdate(const SGDTensorList tl,
+                                           const bool nesterov,
+                                           const bool first_step) {
+  const int t = tl.block_to_tensor[blockIdx.x];
+  const size_t start = (size_t)tl.block_to_chunk[blockIdx.x] * MT_CHUNK_SIZE;
+  const size_t end = min(start + MT_CHUNK_SIZE, tl.size[t]);
+  const float *grad = tl.grad[t];
+  float *buf = tl.buf[t];
+  float *param = tl.param[t];
+  const float lr = tl.lr[t], momentum = tl.momentum[t];
+  const float dampening = tl.dampening[t], weight_decay = tl.weight_decay[t];
+  for (size_t i = start + threadIdx.x; i < end; i += blockDim.x) {
+    float g = grad[i] + weight_decay * param[i];
+    if (momentum != 0) {
+      float b = first_step ? g : momentum * buf[i] + (1 - dampening) * g;
+      buf[i] = b;
+      g = nesterov ? g + momentum * b : b;
+    }
+    param[i] -= lr * g;
+  }
+}
+
+__global__ void KernelSignErrorFeedback(const size_t n, float *in,
+                                        const float *residual,
+                                        float *abs_sum) {
+  __shared__ float aux[CU1DBLOCK];
+  float local = 0;
+  for (size_t i = blockIdx.x * blockDim.x + threadIdx.x; i < n;
+       i += blockDim.x * gridDim.x) {
+    float e = in[i] + residual[i];
+    in[i] = e;
+    local += fabsf(e);
+  }
+  aux[threadIdx.x] = local;
+
+  int total_threads = blockDim.x;
+  __syncthreads();
+  while (total_threads > 1) {
+    int half_point = ((1 + total_threads) >> 1);
+    if (threadIdx.x < half_point) {
+      if (threadIdx.x + half_point < total_threads) {
+        aux[threadIdx.x] += aux[threadIdx.x + half_point];
+      }
+    }
+    __syncthreads();
+    total_threads = ((total_threads + 1) >> 1);
+  }
+
+  // one atomic add per block
+  if (threadIdx.x == 0) atomicAdd(abs_sum, aux[0]);
+}
+
+__global__ void KernelSignQuantize(const size_t n, const float *in,
+                                   const float *abs_sum, int8_t *signs,
+                                   float *residual) {
+  const float scale = *abs_sum / n;
+  for (size_t i = blockIdx.x * blockDim.x + threadIdx.x; i < n;
+       i += blockDim.x * gridDim.x) {
+    int8_t s = in[i] >= 0 ? 1 : -1;
+    signs[i] = s;
+    residual[i] = in[i] - scale * s;
+  }
+}
+
+__global__ void KernelSignDequantize(const size_t n, const int8_t *signs,
+                                     const float *abs_sum, const float alpha,
+                                     float *out) {
+  const float scale = alpha * *abs_sum / n;
+  for (size_t i = blockIdx.x * blockDim.x + threadIdx.x; i < n;
+       i += blockDim.x * gridDim.x) {
+    out[i] = scale * signs[i];
+  }
+}
+
+struct CopyTensorList {
+  float *tensor[MT_MAX_TENSORS];
+  size_t size[MT_MAX_TENSORS];
+  size_t offset[MT_MAX_TENSORS];
+  unsigned char block_to_tensor[MT_MAX_BLOCKS];
+  int block_to_chunk[MT_MAX_BLOCKS];
+};
+
+__global__ void KernelMultiTensorCopy(const CopyTensorList tl, float *flat,
+                                      const bool gather, const float alpha) {
+  const int t = tl.block_to_tensor[blockIdx.x];
+  const size_t start = (size_t)tl.block_to_chunk[blockIdx.x] * MT_CHUNK_SIZE;
+  const size_t end = min(start + MT_CHUNK_SIZE, tl.size[t]);
+  float *tensor = tl.tensor[t];
+  float *part = flat + tl.offset[t];
+  for (size_t i = start + threadIdx.x; i < end; i += blockDim.x) {
+    if (gather)
+      part[i] = tensor[i];
+    else
+      tensor[i] = alpha * part[i];
   }
 }
 
@@ -425,12 +576,138 @@ GenUnaryCudaKernel(atanh,KernelAtanh,atanhf);
 // Functions call kernels
 // ********************************
 
-void float2half(const size_t n, const float *in, __half *out, cudaStream_t s) {
-  KernelFloat2Half <<<ceil(n / CU1DBLOCKF), CU1DBLOCKF, 0, s>>> (n, in, out);
-}
-
-void half2float(const size_t n, const __half *in, float *out, cudaStream_t s) {
-  KernelHalf2Float <<<ceil(n / CU1DBLOCKF), CU1DBLOCKF, 0, s>>> (n, in, out);
+void float2half(const size_t n, const float *in, const float alpha,
+                __half *out, cudaStream_t s) {
+  KernelFloat2Half <<<ceil(n / CU1DBLOCKF), CU1DBLOCKF, 0, s>>>
+      (n, in, alpha, out);
+}
+
+void half2float(const size_t n, const __half *in, const float alpha,
+                float *out, int *overflow, cudaStream_t s) {
+  KernelHalf2Float <<<ceil(n / CU1DBLOCKF), CU1DBLOCKF, 0, s>>>
+      (n, in, alpha, out, overflow);
+}
+
+void axpby(const size_t n, const float alpha, const float *in,
+           const float beta, float *out, cudaStream_t s) {
+  KernelAxpby <<<ceil(n / CU1DBLOCKF), CU1DBLOCKF, 0, s>>>
+      (n, alpha, in, beta, out);
+}
+
+void sgd_update(const size_t n, const float lr, const float momentum,
+                const float dampening, const float weight_decay,
+                const bool nesterov, const bool first_step,
+                const float *grad, float *buf, float *param, cudaStream_t s) {
+  KernelSGDUpdate <<<ceil(n / CU1DBLOCKF), CU1DBLOCKF, 0, s>>>
+      (n, lr, momentum, dampening, weight_decay, nesterov, first_step, grad,
+       buf, param);
+}
+
+void multi_tensor_sgd_update(const size_t num, const size_t *sizes,
+                             const float *lrs, const float *momenta,
+                             const float *dampenings,
+                             const float *weight_decays,
+                             const bool nesterov, const bool first_step,
+                             const float **grads, float **bufs, float **params,
+                             cudaStream_t s) {
+  SGDTensorList tl;
+  int ntensor = 0, nblock = 0;
+  for (size_t t = 0; t < num; t++) {
+    if (sizes[t] == 0) continue;
+    tl.grad[ntensor] = grads[t];
+    tl.buf[ntensor] = bufs[t];
+    tl.param[ntensor] = params[t];
+    tl.size[ntensor] = sizes[t];
+    tl.lr[ntensor] = lrs[t];
+    tl.momentum[ntensor] = momenta[t];
+    tl.dampening[ntensor] = dampenings[t];
+    tl.weight_decay[ntensor] = weight_decays[t];
+    ntensor++;
+    const size_t nchunk = (sizes[t] + MT_CHUNK_SIZE - 1) / MT_CHUNK_SIZE;
+    for (size_t c = 0; c < nchunk; c++) {
+      tl.block_to_tensor[nblock] = ntensor - 1;
+      tl.block_to_chunk[nblock] = c;
+      nblock++;
+      bool last_chunk = c == nchunk - 1;
+      if (nblock == MT_MAX_BLOCKS || (ntensor == MT_MAX_TENSORS && last_chunk)) {
+        KernelMultiTensorSGDUpdate <<<nblock, MT_BLOCK, 0, s>>>
+            (tl, nesterov, first_step);
+        nblock = 0;
+        if (last_chunk) {
+          ntensor = 0;
+        } else {
+          // the remaining chunks of the current tensor go to the next launch
+          tl.grad[0] = tl.grad[ntensor - 1];
+          tl.buf[0] = tl.buf[ntensor - 1];
+          tl.param[0] = tl.param[ntensor - 1];
+          tl.size[0] = tl.size[ntensor - 1];
+          tl.lr[0] = tl.lr[ntensor - 1];
+          tl.momentum[0] = tl.momentum[ntensor - 1];
+          tl.dampening[0] = tl.dampening[ntensor - 1];
+          tl.weight_decay[0] = tl.weight_decay[ntensor - 1];
+          ntensor = 1;
+        }
+      }
+    }
+  }
+  if (nblock > 0)
+    KernelMultiTensorSGDUpdate <<<nblock, MT_BLOCK, 0, s>>>
+        (tl, nesterov, first_step);
+}
+
+void sign_compress(const size_t n, float *in, float *residual, int8_t *signs,
+                   float *abs_sum, cudaStream_t s) {
+  cudaMemsetAsync(abs_sum, 0, sizeof(float), s);
+  KernelSignErrorFeedback <<<ceil(n / CU1DBLOCKF), CU1DBLOCKF, 0, s>>>
+      (n, in, residual, abs_sum);
+  KernelSignQuantize <<<ceil(n / CU1DBLOCKF), CU1DBLOCKF, 0, s>>>
+      (n, in, abs_sum, signs, residual);
+}
+
+void sign_decompress(const size_t n, const int8_t *signs, const float *abs_sum,
+                     const float alpha, float *out, cudaStream_t s) {
+  KernelSignDequantize <<<ceil(n / CU1DBLOCKF), CU1DBLOCKF, 0, s>>>
+      (n, signs, abs_sum, alpha, out);
+}
+
+void multi_tensor_copy(const size_t num, const size_t *sizes, float **tensors,
+                       float *flat, const bool gather, const float alpha,
+                       cudaStream_t s) {
+  CopyTensorList tl;
+  int ntensor = 0, nblock = 0;
+  size_t offset = 0;
+  for (size_t t = 0; t < num; t++) {
+    if (sizes[t] == 0) continue;
+    tl.tensor[ntensor] = tensors[t];
+    tl.size[ntensor] = sizes[t];
+    tl.offset[ntensor] = offset;
+    offset += sizes[t];
+    ntensor++;
+    const size_t nchunk = (sizes[t] + MT_CHUNK_SIZE - 1) / MT_CHUNK_SIZE;
+    for (size_t c = 0; c < nchunk; c++) {
+      tl.block_to_tensor[nblock] = ntensor - 1;
+      tl.block_to_chunk[nblock] = c;
+      nblock++;
+      bool last_chunk = c == nchunk - 1;
+      if (nblock == MT_MAX_BLOCKS || (ntensor == MT_MAX_TENSORS && last_chunk)) {
+        KernelMultiTensorCopy <<<nblock, MT_BLOCK, 0, s>>>
+            (tl, flat, gather, alpha);
+        nblock = 0;
+        if (last_chunk) {
+          ntensor = 0;
+        } else {
+          // the remaining chunks of the current tensor go to the next launch
+          tl.tensor[0] = tl.tensor[ntensor - 1];
+          tl.size[0] = tl.size[ntensor - 1];
+          tl.offset[0] = tl.offset[ntensor - 1];
+          ntensor = 1;
+        }
+      }
+    }
+  }
+  if (nblock > 0)
+    KernelMultiTensorCopy <<<nblock, MT_BLOCK, 0, s>>>
+        (tl, flat, gather, alpha);
 }
 
 void set(const size_t n, const float v, float *out, cudaStream_t s) {
@@ -21,6 +21,7 @@
 #ifndef SRC_CORE_TENSOR__MATH_KERNEL_H_
 #define SRC_CORE_TENSOR__MATH_KERNEL_H_
 
+#include <cstdint>
 #include "cuda_fp16.h"
 #include "singa/singa_config.h"
 #ifdef USE_CUDA
@@ -119,6 +120,10 @@ void mult(const size_t n, const float *in1, const float *in2, float *out,
 void div(const size_t n, const float *in1, const float *in2, float *out,
          cudaStream_t s);
 
+// out = alpha * in + beta * out
+void axpby(const size_t n, const float alpha, const float *in,
+           const float beta, float *out, cudaStream_t s);
+
 // void sum(const size_t n, const float *in, float *out, cudaStream_t s);
 
 void ComputeCrossEntropy(bool int_target, const size_t batchsize,
@@ -131,9 +136,44 @@ void SoftmaxCrossEntropyBwd(bool int_target, const size_t batchsize,
 void RowMax(const size_t nrow, const size_t ncol, const float *inPtr,
     float *outPtr, cudaStream_t stream);
 
-void float2half(const size_t n, const float *in, __half *out, cudaStream_t s);
-
-void half2float(const size_t n, const __half *in, float *out, cudaStream_t s);
+// out = alpha * in
+void float2half(const size_t n, const float *in, const float alpha,
+                __half *out, cudaStream_t s);
+
+// out = alpha * in; *overflow is set to 1 if any element of in is inf or nan
+void half2float(const size_t n, const __half *in, const float alpha,
+                float *out, int *overflow, cudaStream_t s);
+
+// 1-bit (sign) compression with error feedback: in += residual; signs =
+// sign(in); residual = in - scale * signs, where scale = mean(|in|);
+// abs_sum is set to sum(|in|) on the device
+void sign_compress(const size_t n, float *in, float *residual, int8_t *signs,
+                   float *abs_sum, cudaStream_t s);
+
+// out = alpha * abs_sum / n * signs
+void sign_decompress(const size_t n, const int8_t *signs, const float *abs_sum,
+                     const float alpha, float *out, cudaStream_t s);
+
+// copy 'num' tensors into consecutive positions of the flat buffer if gather
+// is true, or copy them back from the flat buffer multiplied by alpha otherwise
+void multi_tensor_copy(const size_t num, const size_t *sizes, float **tensors,
+                       float *flat, const bool gather, const float alpha,
+                       cudaStream_t s);
+
+// optimizers
+void sgd_update(const size_t n, const float lr, const float momentum,
+                const float dampening, const float weight_decay,
+                const bool nesterov, const bool first_step,
+                const float *grad, float *buf, float *param, cudaStream_t s);
+// update 'num' tensors, whose sizes and hyper-parameters are given per
+// tensor, by one kernel launch per chunk of tensors
+void multi_tensor_sgd_update(const size_t num, const size_t *sizes,
+                             const float *lrs, const float *momenta,
+                             const float *dampenings,
+                             const float *weight_decays,
+                             const bool nesterov, const bool first_step,
+                             const float **grads, float **bufs, float **params,
+                             cudaStream_t s);
 
 }  // cuda
 
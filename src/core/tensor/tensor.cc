@@ -1231,6 +1231,23 @@ void Axpy(const SType alpha, const Tensor &in, Tensor *out) {
 template
 void Axpy<float>(const float alpha, const Tensor &in, Tensor *out);
 
+template <typename SType>
+void Axpby(const SType alpha, const Tensor &in, const SType beta,
+           Tensor *out) {
+  CHECK_EQ(in.Size(), out->Size());
+  TYPE_LANG_SWITCH(in.data_type(), DType, in.device()->lang(), Lang, {
+    auto a = TypeCast<SType, DType>(alpha);
+    auto b = TypeCast<SType, DType>(beta);
+    out->device()->Exec([a, in, b, out](Context * ctx) {
+      Axpby<DType, Lang>(a, in, b, out, ctx);
+    }, {in.block(), out->block()}, {out->block()});
+  });
+}
+
+template
+void Axpby<float>(const float alpha, const Tensor &in, const float beta,
+                  Tensor *out);
+
 Tensor Mult(const Tensor &A, const Tensor &B) {
   Shape s;
   s.push_back(A.shape(0));
@@ -1269,6 +1286,95 @@ void Mult(const SType alpha, const Tensor &A, const Tensor &B, const SType beta,
   }
 }
 
+// ================Optimizer operations=======================================
+template <typename SType>
+void FusedSGDUpdate(Tensor *param, const Tensor &grad, Tensor *buf,
+                    const SType lr, const SType momentum,
+                    const SType dampening, const SType weight_decay,
+                    const bool nesterov, const bool first_step) {
+  CHECK_EQ(param->Size(), grad.Size());
+  if (momentum != 0) {
+    CHECK_EQ(param->Size(), buf->Size());
+    CHECK(buf->device() == param->device())
+        << "the momentum buffer must be on the device of the param";
+  }
+  TYPE_LANG_SWITCH(param->data_type(), DType, param->device()->lang(), Lang, {
+    auto l = TypeCast<SType, DType>(lr);
+    auto m = TypeCast<SType, DType>(momentum);
+    auto d = TypeCast<SType, DType>(dampening);
+    auto w = TypeCast<SType, DType>(weight_decay);
+    param->device()->Exec([l, m, d, w, nesterov, first_step, param, grad,
+    buf](Context * ctx) {
+      FusedSGDUpdate<DType, Lang>(l, m, d, w, nesterov, first_step, grad, buf,
+                                  param, ctx);
+    }, {param->block(), grad.block(), buf->block()},
+    {param->block(), buf->block()});
+  });
+}
+
+template
+void FusedSGDUpdate<float>(Tensor *param, const Tensor &grad, Tensor *buf,
+                           const float lr, const float momentum,
+                           const float dampening, const float weight_decay,
+                           const bool nesterov, const bool first_step);
+
+template <typename SType>
+void MultiTensorSGD(vector<Tensor> &params, const vector<Tensor> &grads,
+                    vector<Tensor> &bufs, const vector<SType> &lrs,
+                    const vector<SType> &momenta,
+                    const vector<SType> &dampenings,
+                    const vector<SType> &weight_decays, const bool nesterov,
+                    const bool first_step) {
+  const size_t num = params.size();
+  CHECK_EQ(num, grads.size());
+  CHECK_EQ(num, lrs.size());
+  CHECK_EQ(num, momenta.size());
+  CHECK_EQ(num, dampenings.size());
+  CHECK_EQ(num, weight_decays.size());
+  if (params.empty()) return;
+  auto dev = params[0].device();
+  auto dtype = params[0].data_type();
+  vector<Block*> read_blocks, write_blocks;
+  for (size_t i = 0; i < num; i++) {
+    CHECK_EQ(params[i].Size(), grads[i].Size());
+    CHECK(params[i].device() == dev) << "params must be on the same device";
+    CHECK_EQ(params[i].data_type(), dtype);
+    read_blocks.push_back(params[i].block());
+    read_blocks.push_back(grads[i].block());
+    write_blocks.push_back(params[i].block());
+    if (momenta[i] != 0) {
+      CHECK_LT(i, bufs.size());
+      CHECK_EQ(params[i].Size(), bufs[i].Size());
+      CHECK(bufs[i].device() == dev)
+          << "the momentum buffers must be on the device of the params";
+      if (!first_step) read_blocks.push_back(bufs[i].block());
+      write_blocks.push_back(bufs[i].block());
+    }
+  }
+  TYPE_LANG_SWITCH(dtype, DType, dev->lang(), Lang, {
+    vector<DType> l(num), m(num), d(num), w(num);
+    for (size_t i = 0; i < num; i++) {
+      l[i] = TypeCast<SType, DType>(lrs[i]);
+      m[i] = TypeCast<SType, DType>(momenta[i]);
+      d[i] = TypeCast<SType, DType>(dampenings[i]);
+      w[i] = TypeCast<SType, DType>(weight_decays[i]);
+    }
+    dev->Exec([l, m, d, w, nesterov, first_step, params, grads,
+    bufs](Context * ctx) {
+      MultiTensorSGD<DType, Lang>(l, m, d, w, nesterov, first_step, params,
+                                  grads, bufs, ctx);
+    }, read_blocks, write_blocks);
+  });
+}
+
+template
+void MultiTensorSGD<float>(vector<Tensor> &params, const vector<Tensor> &grads,
+                           vector<Tensor> &bufs, const vector<float> &lrs,
+                           const vector<float> &momenta,
+                           const vector<float> &dampenings,
+                           const vector<float> &weight_decays,
+                           const bool nesterov, const bool first_step);
+
 // ************************
 // Misc.
 // ************************
@@ -373,6 +373,13 @@ void Axpy(const DType alpha, const Tensor &in, Tensor *out,
   LOG(FATAL) << "Axpy Not Implemented";
 }
 
+/// out = alpha * in + beta * out
+template <typename DType, typename Lang>
+void Axpby(const DType alpha, const Tensor &in, const DType beta, Tensor *out,
+           Context *ctx) {
+  LOG(FATAL) << "Axpby Not Implemented";
+}
+
 /// out = ||in||_2^2, i.e, L2 norm.
 template <typename DType, typename Lang>
 void Nrm2(const Tensor &in, float *out, Context *ctx) {
@@ -447,6 +454,41 @@ template <typename DType, typename Lang>
 void RowMax(const Tensor &in, Tensor *out, Context* ctx) {
   LOG(FATAL) << "Not Implemented";
 }
+
+// *********************************************************
+// Optimizer functions
+// *********************************************************
+
+/// g = grad + weight_decay * param;
+/// buf = first_step ? g : momentum * buf + (1 - dampening) * g;
+/// g = nesterov ? g + momentum * buf : buf; param -= lr * g.
+/// buf is not accessed if momentum is 0.
+template <typename DType, typename Lang>
+void FusedSGDUpdate(const DType lr, const DType momentum,
+                    const DType dampening, const DType weight_decay,
+                    const bool nesterov, const bool first_step,
+                    const Tensor &grad, Tensor *buf, Tensor *param,
+                    Context *ctx) {
+  LOG(FATAL) << "FusedSGDUpdate Not Implemented";
+}
+
+/// FusedSGDUpdate over a list of tensors with per-tensor hyper-parameters;
+/// it updates the tensors one by one unless specialized for the device.
+template <typename DType, typename Lang>
+void MultiTensorSGD(const vector<DType> &lrs, const vector<DType> &momenta,
+                    const vector<DType> &dampenings,
+                    const vector<DType> &weight_decays,
+                    const bool nesterov, const bool first_step,
+                    const vector<Tensor> &params, const vector<Tensor> &grads,
+                    const vector<Tensor> &bufs, Context *ctx) {
+  for (size_t i = 0; i < params.size(); i++) {
+    Tensor param = params[i];
+    Tensor buf = momenta[i] != 0 ? bufs[i] : params[i];
+    FusedSGDUpdate<DType, Lang>(lrs[i], momenta[i], dampenings[i],
+                                weight_decays[i], nesterov, first_step,
+                                grads[i], &buf, &param, ctx);
+  }
+}
 // **************************************
 // Matrix functions
 // **************************************
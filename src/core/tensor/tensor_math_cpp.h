@@ -915,6 +915,48 @@ void SoftMax<float, lang::Cpp>(const Tensor &in, Tensor *out, Context* ctx) {
   out->Reshape(in.shape());
 }
 
+template <>
+void Axpby<float, lang::Cpp>(const float alpha, const Tensor& in,
+                             const float beta, Tensor *out, Context *ctx) {
+  const float *inPtr = static_cast<const float *>(in.block()->data());
+  float *outPtr = static_cast<float *>(out->block()->mutable_data());
+  vector<int> traversal_info = generate_traversal_info(in);
+  vector<int> shape_multipliers = generate_shape_multipliers(in);
+
+  for (size_t i = 0; i < in.Size(); i++) {
+    float x = alpha * inPtr[traversal_info[in.shape().size()]];
+    outPtr[i] = beta == 0 ? x : x + beta * outPtr[i];
+    traverse_next(in, shape_multipliers, traversal_info, i + 1);
+  }
+}
+
+// =========Optimizer operations =============================================
+template <>
+void FusedSGDUpdate<float, lang::Cpp>(const float lr, const float momentum,
+                                      const float dampening,
+                                      const float weight_decay,
+                                      const bool nesterov,
+                                      const bool first_step,
+                                      const Tensor& grad, Tensor *buf,
+                                      Tensor *param, Context *ctx) {
+  const float *gradPtr = static_cast<const float *>(grad.block()->data());
+  float *paramPtr = static_cast<float *>(param->block()->mutable_data());
+  const size_t num = param->Size();
+  if (momentum == 0) {
+    for (size_t i = 0; i < num; i++) { //not using strided traversal
+      paramPtr[i] -= lr * (gradPtr[i] + weight_decay * paramPtr[i]);
+    }
+    return;
+  }
+  float *bufPtr = static_cast<float *>(buf->block()->mutable_data());
+  for (size_t i = 0; i < num; i++) { //not using strided traversal
+    float g = gradPtr[i] + weight_decay * paramPtr[i];
+    bufPtr[i] = first_step ? g : momentum * bufPtr[i] + (1 - dampening) * g;
+    g = nesterov ? g + momentum * bufPtr[i] : bufPtr[i];
+    paramPtr[i] -= lr * g;
+  }
+}
+
 // =========Matrix operations ================================================
 /*
 template <>
@@ -823,6 +823,16 @@ void Axpy<float, lang::Cuda>(const float alpha,
   CUBLAS_CHECK(cublasSaxpy(handle, num, &alpha, inPtr, 1, outPtr, 1));
 }
 
+/// out = alpha * in + beta * out
+template <>
+void Axpby<float, lang::Cuda>(const float alpha, const Tensor& in,
+                              const float beta, Tensor* out, Context* ctx) {
+  const float* inPtr = static_cast<const float*>(in.block()->data());
+  float* outPtr = static_cast<float*>(out->block()->mutable_data());
+  const size_t num = in.Size();
+  cuda::axpby(num, alpha, inPtr, beta, outPtr, ctx->stream);
+}
+
 /// out = \sum_i in1[i] * in2[i]
 template <>
 void Dot<float, lang::Cuda>(const Tensor& in1,
@@ -1132,6 +1142,54 @@ void Sum<float, lang::Cuda>(const Tensor& in, float* out,
 #endif  // CUDNN_MAJOR < 7
 }
 
+// =========================Optimizer operations==============================
+template <>
+void FusedSGDUpdate<float, lang::Cuda>(const float lr, const float momentum,
+                                       const float dampening,
+                                       const float weight_decay,
+                                       const bool nesterov,
+                                       const bool first_step,
+                                       const Tensor& grad, Tensor* buf,
+                                       Tensor* param, Context* ctx) {
+  const float* gradPtr = static_cast<const float*>(grad.block()->data());
+  float* paramPtr = static_cast<float*>(param->block()->mutable_data());
+  float* bufPtr = nullptr;
+  if (momentum != 0)
+    bufPtr = static_cast<float*>(buf->block()->mutable_data());
+  const size_t num = param->Size();
+  cuda::sgd_update(num, lr, momentum, dampening, weight_decay, nesterov,
+                   first_step, gradPtr, bufPtr, paramPtr, ctx->stream);
+}
+
+template <>
+void MultiTensorSGD<float, lang::Cuda>(const vector<float>& lrs,
+                                       const vector<float>& momenta,
+                                       const vector<float>& dampenings,
+                                       const vector<float>& weight_decays,
+                                       const bool nesterov,
+                                       const bool first_step,
+                                       const vector<Tensor>& params,
+                                       const vector<Tensor>& grads,
+                                       const vector<Tensor>& bufs,
+                                       Context* ctx) {
+  const size_t num = params.size();
+  vector<size_t> sizes(num);
+  vector<const float*> gradPtrs(num);
+  vector<float*> bufPtrs(num, nullptr);
+  vector<float*> paramPtrs(num);
+  for (size_t i = 0; i < num; i++) {
+    sizes[i] = params[i].Size();
+    gradPtrs[i] = static_cast<const float*>(grads[i].block()->data());
+    paramPtrs[i] = static_cast<float*>(params[i].block()->mutable_data());
+    if (momenta[i] != 0)
+      bufPtrs[i] = static_cast<float*>(bufs[i].block()->mutable_data());
+  }
+  cuda::multi_tensor_sgd_update(num, sizes.data(), lrs.data(), momenta.data(),
+                                dampenings.data(), weight_decays.data(),
+                                nesterov, first_step, gradPtrs.data(),
+                                bufPtrs.data(), paramPtrs.data(), ctx->stream);
+}
+
 
 }  // namespace singa
 
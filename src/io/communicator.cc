@@ -18,6 +18,7 @@
 
 #include "singa/utils/cuda_utils.h"
 #include <iostream>
+#include <algorithm>
 
 #ifdef USE_DIST
 
@@ -46,6 +47,24 @@ static void getHostName(char* hostname, int maxlen) {
   }
 }
 
+// copy the tensors into consecutive positions of the fused buffer if gather is
+// true, or copy them back from the fused buffer multiplied by alpha otherwise;
+// it launches one kernel per chunk of tensors instead of one memcpy per tensor
+static size_t fusedCopy(vector<Tensor> &t, float* buff, size_t limit, bool gather, float alpha, cudaStream_t stream) {
+  vector<float*> addrs(t.size());
+  vector<size_t> sizes(t.size());
+  size_t offset = 0;
+  for (size_t i = 0; i < t.size(); i++) {
+    addrs[i] = static_cast<float*>(t[i].block()->mutable_data());
+    sizes[i] = t[i].Size();
+    offset += sizes[i];
+  }
+  // the fused tensors must fit into the buffer of limit elements
+  CHECK_LE(offset, limit);
+  cuda::multi_tensor_copy(t.size(), sizes.data(), addrs.data(), buff, gather, alpha, stream);
+  return offset;
+}
+
 NcclIdHolder::NcclIdHolder(){
   ncclGetUniqueId(&id); 
 } // end of constructor 
@@ -59,6 +78,8 @@ Communicator::Communicator(int gpu_num, int gpu_per_node, const NcclIdHolder &ho
   maxSize = (size_t) buffSize;
   // this contructor is for NCCL WITHOUT MPI
   UseMPI = false;
+  // all the GPUs are in a single node
+  hierarchical = false;
   // Determine the rank of the collective communication
   totalMPIRanksInGlobal=gpu_per_node;
   MPIRankInLocal=gpu_num;
@@ -73,7 +94,7 @@ Communicator::Communicator(int gpu_num, int gpu_per_node, const NcclIdHolder &ho
 } // end of constructor 
 
 // contructer for application with MPI
-Communicator::Communicator(int buffSize){
+Communicator::Communicator(int buffSize, bool hierarchical){
 
   maxSize = (size_t) buffSize;
   // this contructor is for NCCL WITH MPI
@@ -104,6 +125,10 @@ Communicator::Communicator(int buffSize){
   // setup cuda stream and nccl communicator  
   setup(MPIRankInLocal);
 
+  // setup the intra-node and inter-node nccl communicators
+  this->hierarchical = false;
+  if (hierarchical) setupHierarchical(hostHashs);
+
 } // end of constructor 
 
 void Communicator::setup(int gpu_num){
@@ -118,23 +143,138 @@ void Communicator::setup(int gpu_num){
   CUDA_CHECK(cudaMalloc(&fusedSendBuffHalf, maxSize * sizeof(__half)));
   CUDA_CHECK(cudaMalloc(&fusedRecvBuffHalf, maxSize * sizeof(__half)));
   CUDA_CHECK(cudaEventCreateWithFlags(&event, cudaEventBlockingSync | cudaEventDisableTiming));
+  numSyncs = 0;
+  inGroup = false;
+  CUDA_CHECK(cudaMalloc(&signScale, sizeof(float)));
+  CUDA_CHECK(cudaMalloc(&halfOverflow, sizeof(int)));
+  CUDA_CHECK(cudaMemset(halfOverflow, 0, sizeof(int)));
 
 }
 
-void Communicator::allReduce(int size, void* sendbuff, void* recvbuff, ncclDataType_t ncclType)
+void Communicator::setupHierarchical(const uint64_t *hostHashs){
+
+  // the ranks of a node are identified by the lowest global rank on the node
+  int node = MPIRankInGlobal;
+  localSize = 0;
+  for (int p=0; p<totalMPIRanksInGlobal; p++) {
+    if (hostHashs[p] != hostHashs[MPIRankInGlobal]) continue;
+    if (node == MPIRankInGlobal) node = p;
+    localSize++;
+  }
+
+  // the partitions of the intra-node reduce scatter must be aligned across
+  // the nodes, hence every node must have the same number of GPUs
+  int minLocalSize, maxLocalSize;
+  MPICHECK(MPI_Allreduce(&localSize, &minLocalSize, 1, MPI_INT, MPI_MIN, MPI_COMM_WORLD));
+  MPICHECK(MPI_Allreduce(&localSize, &maxLocalSize, 1, MPI_INT, MPI_MAX, MPI_COMM_WORLD));
+  if (minLocalSize != maxLocalSize) {
+    LOG(WARNING) << "Hierarchical all-reduce is disabled as the nodes have "
+                 << "different numbers of GPUs";
+    return;
+  }
+  if (localSize == 1 || localSize == totalMPIRanksInGlobal) return;
+
+  MPI_Comm intraMPIComm, interMPIComm;
+  MPICHECK(MPI_Comm_split(MPI_COMM_WORLD, node, MPIRankInLocal, &intraMPIComm));
+  MPICHECK(MPI_Comm_split(MPI_COMM_WORLD, MPIRankInLocal, MPIRankInGlobal, &interMPIComm));
+
+  // the first rank of each sub-communicator generates and broadcasts its id
+  int interRank, interSize;
+  MPICHECK(MPI_Comm_rank(interMPIComm, &interRank));
+  MPICHECK(MPI_Comm_size(interMPIComm, &interSize));
+  ncclUniqueId intraId, interId;
+  if (MPIRankInLocal == 0) ncclGetUniqueId(&intraId);
+  if (interRank == 0) ncclGetUniqueId(&interId);
+  MPICHECK(MPI_Bcast((void *)&intraId, sizeof(intraId), MPI_BYTE, 0, intraMPIComm));
+  MPICHECK(MPI_Bcast((void *)&interId, sizeof(interId), MPI_BYTE, 0, interMPIComm));
+
+  NCCLCHECK(ncclCommInitRank(&intraComm, localSize, intraId, MPIRankInLocal));
+  NCCLCHECK(ncclCommInitRank(&interComm, interSize, interId, interRank));
+  MPICHECK(MPI_Comm_free(&intraMPIComm));
+  MPICHECK(MPI_Comm_free(&interMPIComm));
+  hierarchical = true;
+
+}
+
+void Communicator::allReduce(int size, void* sendbuff, void* recvbuff, ncclDataType_t ncclType,
+                             ncclRedOp_t op)
 {
 
+  int offset = 0;
+  if (hierarchical) {
+    // reduce scatter within the node, all-reduce the partition of each GPU
+    // across the nodes, and then all-gather the partitions within the node;
+    // the nodes have the same number of GPUs, hence the average of the
+    // averages is the global average
+    int count = size / localSize;
+    size_t typeSize = (ncclType == ncclHalf) ? sizeof(__half) :
+                      (ncclType == ncclInt8) ? sizeof(int8_t) : sizeof(float);
+    char* part = static_cast<char*>(recvbuff) + MPIRankInLocal * count * typeSize;
+    if (count > 0) {
+      NCCLCHECK(ncclReduceScatter((const void*)sendbuff, (void*)part, count,
+                                  ncclType, op, intraComm, s));
+      NCCLCHECK(ncclAllReduce((const void*)part, (void*)part, count, ncclType,
+                              op, interComm, s));
+      NCCLCHECK(ncclAllGather((const void*)part, recvbuff, count, ncclType,
+                              intraComm, s));
+    }
+    // the remainder which is not divisible by localSize goes to the flat ring
+    offset = count * localSize;
+    sendbuff = static_cast<char*>(sendbuff) + offset * typeSize;
+    recvbuff = static_cast<char*>(recvbuff) + offset * typeSize;
+    if (offset == size) return;
+  }
+
   NCCLCHECK(ncclAllReduce((const void*)sendbuff,
                              (void*)recvbuff,
-                             size,
+                             size - offset,
                              ncclType,
-                             ncclSum,
+                             op,
                              comm, 
                              s));
 
 }
 
+int Communicator::recordSync(cudaStream_t stream){
+  // record the event on the stream which produces the result of a synch call,
+  // reusing the events of the previous iterations
+  if (numSyncs == (int) syncEvents.size()) {
+    cudaEvent_t e;
+    CUDA_CHECK(cudaEventCreateWithFlags(&e, cudaEventDisableTiming));
+    syncEvents.push_back(e);
+  }
+  // in a group the collectives are enqueued by groupEnd() only, which
+  // records the events then
+  if (!inGroup) CUDA_CHECK(cudaEventRecord(syncEvents[numSyncs], stream));
+  return numSyncs++;
+}
+
+void Communicator::groupStart(){
+  CHECK(!inGroup) << "The nccl groups cannot be nested";
+  // the steps of the hierarchical all-reduce depend on each other across
+  // the communicators, hence they are not grouped
+  if (hierarchical) return;
+  NCCLCHECK(ncclGroupStart());
+  inGroup = true;
+  groupBegin = numSyncs;
+}
+
+void Communicator::groupEnd(){
+  if (!inGroup) return;
+  NCCLCHECK(ncclGroupEnd());
+  inGroup = false;
+  for (size_t i = 0; i < groupTensors.size(); i++) {
+    float* addr = static_cast<float*>(groupTensors[i].block()->mutable_data());
+    cuda::axpby(groupTensors[i].Size(), groupScales[i], addr, 0.0f, addr, s);
+  }
+  groupTensors.clear();
+  groupScales.clear();
+  for (int i = groupBegin; i < numSyncs; i++)
+    CUDA_CHECK(cudaEventRecord(syncEvents[i], s));
+}
+
 void Communicator::wait(){
+  CHECK(!inGroup) << "Call groupEnd() before wait()";
   //synchronizing on all the CUDA streams used by communicator
   CUDA_CHECK(cudaEventRecord(event, s));
   CUDA_CHECK(cudaStreamWaitEvent(NULL, event, 0));
@@ -142,11 +282,22 @@ void Communicator::wait(){
   CUDA_CHECK(cudaStreamWaitEvent(NULL, event, 0));
   CUDA_CHECK(cudaEventRecord(event, c2));
   CUDA_CHECK(cudaStreamWaitEvent(NULL, event, 0));
+  numSyncs = 0;
+}
+
+void Communicator::waitFor(int idx){
+  //the default cuda stream waits only for the result of the idx-th synch call
+  CHECK_LT(idx, inGroup ? groupBegin : numSyncs);
+  CUDA_CHECK(cudaStreamWaitEvent(NULL, syncEvents[idx], 0));
 }
 
 Communicator::~Communicator(){
   //finalizing NCCL
   ncclCommDestroy(comm);
+  if (hierarchical) {
+    ncclCommDestroy(intraComm);
+    ncclCommDestroy(interComm);
+  }
   if (UseMPI == true) MPICHECK(MPI_Finalize());
   CUDA_CHECK(cudaFree(fusedSendBuff));
   CUDA_CHECK(cudaFree(fusedRecvBuff));
@@ -155,24 +306,23 @@ Communicator::~Communicator(){
   CUDA_CHECK(cudaStreamDestroy(s));
   CUDA_CHECK(cudaStreamDestroy(c1));
   CUDA_CHECK(cudaStreamDestroy(c2));
+  for (auto e : syncEvents) CUDA_CHECK(cudaEventDestroy(e));
+  CUDA_CHECK(cudaFree(signScale));
+  CUDA_CHECK(cudaFree(halfOverflow));
 
 }
 
 
-void Communicator::fusedSynch(vector<Tensor> &t){
+int Communicator::fusedSynch(vector<Tensor> &t, float scale){
+
+  CHECK(!inGroup) << "Only synch calls can be grouped";
 
   // record the event of the default cuda stream and follow it
   CUDA_CHECK(cudaEventRecord(event, NULL));
   CUDA_CHECK(cudaStreamWaitEvent(c1, event, 0));
   
-  size_t offset = 0;
-
   //memory copy to fusedBuff
-  for (size_t i = 0; i < t.size(); i++)
-  {
-    CUDA_CHECK(cudaMemcpyAsync((void*) (fusedSendBuff + offset), (const void*) t[i].block()->mutable_data(), t[i].Size() * sizeof(float), cudaMemcpyDeviceToDevice, c1));
-    offset += t[i].Size();
-  }
+  size_t offset = fusedCopy(t, fusedSendBuff, maxSize, true, 1.0f, c1);
 
   // wait for the memcpy to complete
   CUDA_CHECK(cudaEventRecord(event, c1));
@@ -185,42 +335,56 @@ void Communicator::fusedSynch(vector<Tensor> &t){
   CUDA_CHECK(cudaStreamWaitEvent(c1, event, 0));
 
   //copy data back to tensors after allreduce
-  offset = 0;
-  for (size_t i = 0; i < t.size(); i++)
-  {
-    CUDA_CHECK(cudaMemcpyAsync((void*) t[i].block()->mutable_data(), (const void*) (fusedRecvBuff + offset), t[i].Size() * sizeof(float), cudaMemcpyDeviceToDevice, c1));
-    offset += t[i].Size();
-  }
+  fusedCopy(t, fusedRecvBuff, maxSize, false, scale, c1);
 
+  return recordSync(c1);
 }
 
-void Communicator::synch(Tensor &t){
+int Communicator::synch(Tensor &t, float scale){
 
   // record the event of the default cuda stream and follow it
   CUDA_CHECK(cudaEventRecord(event, NULL));
   CUDA_CHECK(cudaStreamWaitEvent(s, event, 0));
 
-  void* addr = t.block()->mutable_data();
-  allReduce(t.Size(), addr, addr, ncclFloat);
+  float* addr = static_cast<float*>(t.block()->mutable_data());
+  ncclRedOp_t op = ncclSum;
+#if NCCL_VERSION_CODE >= NCCL_VERSION(2, 10, 0)
+  // nccl averages the gradients in the all-reduce itself
+  if (scale == 1.0f / totalMPIRanksInGlobal) {
+    op = ncclAvg;
+    scale = 1.0f;
+  }
+#endif
+  allReduce(t.Size(), addr, addr, ncclFloat, op);
+
+  // otherwise the all-reduce works in place, hence it is scaled by one more
+  // pass on s; in a group the all-reduce is enqueued by groupEnd(), which
+  // scales then
+  if (scale != 1.0f) {
+    if (inGroup) {
+      groupTensors.push_back(t);
+      groupScales.push_back(scale);
+    } else {
+      cuda::axpby(t.Size(), scale, addr, 0.0f, addr, s);
+    }
+  }
 
+  return recordSync(s);
 }
 
-void Communicator::fusedSynchHalf(vector<Tensor> &t){
+int Communicator::fusedSynchHalf(vector<Tensor> &t, float scale, float lossScale){
+
+  CHECK(!inGroup) << "Only synch calls can be grouped";
 
   // record the event of the default cuda stream and follow it
   CUDA_CHECK(cudaEventRecord(event, NULL));
   CUDA_CHECK(cudaStreamWaitEvent(c1, event, 0));
+  waitHalfBuffers();
   
-  size_t offset = 0;
-
   //memory copy to fusedBuff
-  for (size_t i = 0; i < t.size(); i++)
-  {
-    CUDA_CHECK(cudaMemcpyAsync((void*) (fusedSendBuff + offset), (const void*) t[i].block()->mutable_data(), t[i].Size() * sizeof(float), cudaMemcpyDeviceToDevice, c1));
-    offset += t[i].Size();
-  }
+  size_t offset = fusedCopy(t, fusedSendBuff, maxSize, true, 1.0f, c1);
 
-  cuda::float2half(offset, fusedSendBuff, fusedSendBuffHalf, c1);
+  cuda::float2half(offset, fusedSendBuff, lossScale, fusedSendBuffHalf, c1);
 
   // wait for the memcpy to complete
   CUDA_CHECK(cudaEventRecord(event, c1));
@@ -232,19 +396,27 @@ void Communicator::fusedSynchHalf(vector<Tensor> &t){
   CUDA_CHECK(cudaEventRecord(event, s));
   CUDA_CHECK(cudaStreamWaitEvent(c2, event, 0));
 
-  cuda::half2float(offset, fusedRecvBuffHalf, fusedRecvBuff, c2);
+  cuda::half2float(offset, fusedRecvBuffHalf, scale / lossScale, fusedRecvBuff,
+                   halfOverflow, c2);
 
   //copy data back to tensors after allreduce
-  offset = 0;
-  for (size_t i = 0; i < t.size(); i++)
-  {
-    CUDA_CHECK(cudaMemcpyAsync((void*) t[i].block()->mutable_data(), (const void*) (fusedRecvBuff + offset), t[i].Size() * sizeof(float), cudaMemcpyDeviceToDevice, c2));
-    offset += t[i].Size();
-  }
+  fusedCopy(t, fusedRecvBuff, maxSize, false, 1.0f, c2);
 
+  return recordSync(c2);
 }
 
-void Communicator::synchHalf(Tensor &t){
+void Communicator::waitHalfBuffers(){
+  // the half precision buffers are shared by the consecutive calls: c1 waits
+  // for the previous call to finish reading the buffers on c2, which was
+  // after its all-reduce on s; the all-reduce on s of this call follows c1
+  // and hence does not overwrite the buffers while c2 is reading them
+  CUDA_CHECK(cudaEventRecord(event, c2));
+  CUDA_CHECK(cudaStreamWaitEvent(c1, event, 0));
+}
+
+int Communicator::synchHalf(Tensor &t, float scale, float lossScale){
+
+  CHECK(!inGroup) << "Only synch calls can be grouped";
 
   float* addr = static_cast<float*>(t.block()->mutable_data());
 
@@ -252,20 +424,112 @@ void Communicator::synchHalf(Tensor &t){
   CUDA_CHECK(cudaEventRecord(event, NULL));
   CUDA_CHECK(cudaStreamWaitEvent(c1, event, 0));
 
-  cuda::float2half(t.Size(), addr, fusedSendBuffHalf, c1);
+  // the tensors larger than the half precision buffers are reduced chunk by
+  // chunk
+  for (size_t offset = 0; offset < t.Size(); offset += maxSize) {
+    size_t n = std::min(maxSize, t.Size() - offset);
+    waitHalfBuffers();
 
-  // wait for conversion to half precision complete
-  CUDA_CHECK(cudaEventRecord(event, c1));
-  CUDA_CHECK(cudaStreamWaitEvent(s, event, 0));
+    cuda::float2half(n, addr + offset, lossScale, fusedSendBuffHalf, c1);
 
-  allReduce(t.Size(), (void*) fusedSendBuffHalf, (void*) fusedRecvBuffHalf, ncclHalf);
+    // wait for conversion to half precision complete
+    CUDA_CHECK(cudaEventRecord(event, c1));
+    CUDA_CHECK(cudaStreamWaitEvent(s, event, 0));
 
-  // wait for the allreduce to complete
-  CUDA_CHECK(cudaEventRecord(event, s));
-  CUDA_CHECK(cudaStreamWaitEvent(c2, event, 0));
+    allReduce((int) n, (void*) fusedSendBuffHalf, (void*) fusedRecvBuffHalf, ncclHalf);
+
+    // wait for the allreduce to complete
+    CUDA_CHECK(cudaEventRecord(event, s));
+    CUDA_CHECK(cudaStreamWaitEvent(c2, event, 0));
+
+    cuda::half2float(n, fusedRecvBuffHalf, scale / lossScale, addr + offset,
+                     halfOverflow, c2);
+  }
+
+  return recordSync(c2);
+}
+
+bool Communicator::overflow(){
+  // the flag is set by the conversions on c2 only
+  int flag;
+  CUDA_CHECK(cudaMemcpyAsync(&flag, halfOverflow, sizeof(int),
+                             cudaMemcpyDeviceToHost, c2));
+  CUDA_CHECK(cudaMemsetAsync(halfOverflow, 0, sizeof(int), c2));
+  CUDA_CHECK(cudaStreamSynchronize(c2));
+  return flag != 0;
+}
+
+void Communicator::signAllReduce(size_t size, float* data, Tensor &residual, float scale){
+
+  // the signs use the memory of the half precision buffers
+  int8_t* sendSigns = reinterpret_cast<int8_t*>(fusedSendBuffHalf);
+  int8_t* recvSigns = reinterpret_cast<int8_t*>(fusedRecvBuffHalf);
+  size_t chunkSize = 2 * maxSize;
+
+  // the residual is written on c1, which follows the default cuda stream
+  CHECK_EQ(residual.Size(), size) << "The residual must match the tensors";
+  float* res = static_cast<float*>(residual.block()->mutable_data());
+
+  // the tensors larger than the sign buffers are reduced chunk by chunk,
+  // each with its own scale
+  for (size_t offset = 0; offset < size; offset += chunkSize) {
+    size_t n = std::min(chunkSize, size - offset);
+    cuda::sign_compress(n, data + offset, res + offset, sendSigns,
+                        signScale, c1);
+
+    // wait for the compression to complete
+    CUDA_CHECK(cudaEventRecord(event, c1));
+    CUDA_CHECK(cudaStreamWaitEvent(s, event, 0));
+
+    allReduce((int) n, (void*) sendSigns, (void*) recvSigns, ncclInt8);
+    allReduce(1, (void*) signScale, (void*) signScale, ncclFloat);
+
+    // wait for the allreduce to complete; the decompression stays on c1, so
+    // that the next chunk or call does not overwrite the buffers before they
+    // are read
+    CUDA_CHECK(cudaEventRecord(event, s));
+    CUDA_CHECK(cudaStreamWaitEvent(c1, event, 0));
+
+    // the sum of the gradients is approximated by the mean scale of the
+    // ranks times the sum of the signs; the int8 sum does not overflow as
+    // DistOpt limits the ranks to 127
+    cuda::sign_decompress(n, recvSigns, signScale,
+                          scale / totalMPIRanksInGlobal, data + offset, c1);
+  }
+
+}
+
+int Communicator::fusedSynchSign(vector<Tensor> &t, Tensor &residual, float scale){
+
+  CHECK(!inGroup) << "Only synch calls can be grouped";
+
+  // record the event of the default cuda stream and follow it
+  CUDA_CHECK(cudaEventRecord(event, NULL));
+  CUDA_CHECK(cudaStreamWaitEvent(c1, event, 0));
+
+  //memory copy to fusedBuff
+  size_t offset = fusedCopy(t, fusedSendBuff, maxSize, true, 1.0f, c1);
+
+  signAllReduce(offset, fusedSendBuff, residual, scale);
+
+  //copy data back to tensors after allreduce
+  fusedCopy(t, fusedSendBuff, maxSize, false, 1.0f, c1);
+
+  return recordSync(c1);
+}
+
+int Communicator::synchSign(Tensor &t, Tensor &residual, float scale){
+
+  CHECK(!inGroup) << "Only synch calls can be grouped";
+
+  // record the event of the default cuda stream and follow it
+  CUDA_CHECK(cudaEventRecord(event, NULL));
+  CUDA_CHECK(cudaStreamWaitEvent(c1, event, 0));
 
-  cuda::half2float(t.Size(), fusedRecvBuffHalf, addr, c2);
+  signAllReduce(t.Size(), static_cast<float*>(t.block()->mutable_data()),
+                residual, scale);
 
+  return recordSync(c1);
 }
 
 
@@ -45,10 +45,8 @@ void Nesterov::Apply(int epoch, float lr, const string& name, Tensor& grad,
     }
     Tensor& history = history_gradient_[name];
     Tensor tmp = history.Clone();
-    history *= mom;
-    Axpy(lr, grad, &history);
-    tmp *= -mom;
-    Axpy(1 + mom, history, &tmp);
+    Axpby(lr, grad, mom, &history);
+    Axpby(1 + mom, history, -mom, &tmp);
     value -= tmp;
   }
 }
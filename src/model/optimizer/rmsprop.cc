@@ -41,9 +41,8 @@ void RMSProp::Apply(int epoch, float lr, const string& name, Tensor& grad,
     history_gradient_[name].SetValue(0.0f);
   }
   Tensor& history = history_gradient_[name];
-  history *= rho_;
   Tensor tmp = Square(grad);
-  Axpy(1 - rho_, tmp, &history);
+  Axpby(1 - rho_, tmp, rho_, &history);
   Sqrt(history + delta_, &tmp);
   Div(grad, tmp, &tmp);
   Axpy(-lr, tmp, &value);
@@ -48,8 +48,7 @@ void SGD::Apply(int epoch, float lr, const string& name, Tensor& grad,
         history_gradient_[name].SetValue(0.0f);
       }
       Tensor& history = history_gradient_[name];
-      history *= mom;
-      Axpy(lr, grad, &history);
+      Axpby(lr, grad, mom, &history);
       value -= history;
       return;
     }
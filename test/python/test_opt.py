@@ -0,0 +1,612 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+# =============================================================================
+from __future__ import division
+
+import os
+import unittest
+import warnings
+import numpy as np
+
+from singa import tensor
+from singa import autograd
+from singa import device
+from singa import opt
+from singa import singa_wrap
+
+
+def np_sgd(p, g, state, lr, momentum=0, dampening=0, weight_decay=0,
+           nesterov=False):
+    g = g + weight_decay * p
+    if momentum != 0:
+        if 'buf' not in state:
+            state['buf'] = g.copy()
+        else:
+            state['buf'] = momentum * state['buf'] + (1 - dampening) * g
+        if nesterov:
+            g = g + momentum * state['buf']
+        else:
+            g = state['buf']
+    p -= lr * g
+
+
+class TestSGD(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.shapes = [(4, 3), (5,), (2, 2), (7,)]
+        self.params = [np.random.randn(*s).astype(np.float32)
+                       for s in self.shapes]
+        self.grads = [[np.random.randn(*s).astype(np.float32)
+                       for s in self.shapes] for _ in range(4)]
+
+    def check(self, sgd, configs, multi, grad_scale=1.0, on_step=None):
+        # configs[i] is the hyper-parameters of the i-th param for np_sgd
+        ps = [tensor.from_numpy(p.copy()) for p in self.params]
+        nps = [p.copy().astype(np.float64) for p in self.params]
+        states = [{} for _ in self.params]
+        for step, grads in enumerate(self.grads):
+            if on_step is not None:
+                on_step(step, ps, configs)
+            gs = [tensor.from_numpy(g) for g in grads]
+            if multi:
+                sgd.multi_update(ps, gs, grad_scale)
+            else:
+                for p, g in zip(ps, gs):
+                    if grad_scale != 1.0:
+                        g *= grad_scale
+                    sgd.update(p, g)
+            for p, g, s, c in zip(nps, grads, states, configs):
+                np_sgd(p, g * grad_scale, s, **c)
+        for p, ref in zip(ps, nps):
+            np.testing.assert_allclose(tensor.to_numpy(p), ref, rtol=1e-4,
+                                       atol=1e-5)
+        # the momentum buffers hold the momentum of the scaled gradients
+        for p, s in zip(ps, states):
+            if 'buf' in s:
+                buf = sgd.param2state[p]['momentum_buffer']
+                np.testing.assert_allclose(tensor.to_numpy(buf), s['buf'],
+                                           rtol=1e-4, atol=1e-5)
+
+    def test_update(self):
+        for kwargs in [dict(lr=0.1),
+                       dict(lr=0.1, momentum=0.9, weight_decay=0.01),
+                       dict(lr=0.1, momentum=0.9, dampening=0.5),
+                       dict(lr=0.1, momentum=0.9, nesterov=True)]:
+            self.check(opt.SGD(**kwargs), [kwargs] * 4, multi=False)
+
+    def test_multi_update(self):
+        for kwargs in [dict(lr=0.1),
+                       dict(lr=0.1, momentum=0.9, weight_decay=0.01),
+                       dict(lr=0.1, momentum=0.9, dampening=0.5),
+                       dict(lr=0.1, momentum=0.9, nesterov=True)]:
+            self.check(opt.SGD(**kwargs), [kwargs] * 4, multi=True)
+
+    def test_multi_update_grad_scale(self):
+        kwargs = dict(lr=0.1, momentum=0.9, weight_decay=0.01)
+        self.check(opt.SGD(**kwargs), [kwargs] * 4, multi=True,
+                   grad_scale=0.25)
+
+    def test_multi_update_registered(self):
+        # params with different registered configs in one multi_update
+        default = dict(lr=0.1, momentum=0.9, weight_decay=0.01)
+        sgd = opt.SGD(**default)
+        config = dict(lr=0.05, momentum=0.5, dampening=0.1, weight_decay=0,
+                      nesterov=False)
+
+        def register(step, ps, configs):
+            if step == 0:
+                sgd.register([ps[1], ps[3]], config)
+
+        self.check(sgd, [default, config, default, config], multi=True,
+                   grad_scale=0.5, on_step=register)
+
+    def test_lr_change_after_caching(self):
+        sgd = opt.SGD(lr=0.1, momentum=0.9)
+        configs = [dict(lr=0.1, momentum=0.9) for _ in range(4)]
+
+        def decay(step, ps, configs):
+            if step == 2:
+                sgd.default_config['lr'] = 0.01
+                for c in configs:
+                    c['lr'] = 0.01
+
+        self.check(sgd, configs, multi=True, on_step=decay)
+
+    def test_momentum_change_after_caching(self):
+        # e.g., momentum warm-up; the plans without momentum buffers and the
+        # nesterov groups are rebuilt
+        sgd = opt.SGD(lr=0.1)
+        configs = [dict(lr=0.1) for _ in range(4)]
+
+        def warmup(step, ps, configs):
+            if step == 2:
+                sgd.default_config['momentum'] = 0.9
+                for c in configs:
+                    c['momentum'] = 0.9
+            if step == 3:
+                sgd.default_config['nesterov'] = True
+                for c in configs:
+                    c['nesterov'] = True
+
+        self.check(sgd, configs, multi=True, on_step=warmup)
+
+    @unittest.skipIf(not singa_wrap.USE_CUDA, 'CUDA is not enabled')
+    def test_register_before_to_device(self):
+        # the layers move their params to the device of the input in the
+        # first forward propagation, after the params are registered
+        cuda = device.create_cuda_gpu()
+        config = dict(lr=0.1, momentum=0.9, dampening=0, weight_decay=0.01,
+                      nesterov=False)
+        for multi in [False, True]:
+            sgd = opt.SGD(lr=0.1)
+            p = tensor.from_numpy(self.params[0].copy())
+            sgd.register([p], config)
+            p.to_device(cuda)
+            ref = self.params[0].copy().astype(np.float64)
+            state = {}
+            for grads in self.grads:
+                g = tensor.from_numpy(grads[0])
+                g.to_device(cuda)
+                if multi:
+                    sgd.multi_update([p], [g])
+                else:
+                    sgd.update(p, g)
+                np_sgd(ref, grads[0], state, **config)
+            p.to_host()
+            np.testing.assert_allclose(tensor.to_numpy(p), ref, rtol=1e-4,
+                                       atol=1e-5)
+
+    @unittest.skipIf(not singa_wrap.USE_CUDA, 'CUDA is not enabled')
+    def test_param_moved_after_caching(self):
+        # e.g., an evaluation pass on the host between the training steps
+        # moves the params there and back, which replaces their blocks
+        cuda = device.create_cuda_gpu()
+        kwargs = dict(lr=0.1, momentum=0.9)
+        sgd = opt.SGD(**kwargs)
+        ps = [tensor.from_numpy(p.copy()) for p in self.params]
+        refs = [p.copy().astype(np.float64) for p in self.params]
+        states = [{} for _ in self.params]
+        for p in ps:
+            p.to_device(cuda)
+        for step, grads in enumerate(self.grads):
+            if step == 2:
+                for p in ps:
+                    p.to_host()
+                    p.to_device(cuda)
+            gs = [tensor.from_numpy(g) for g in grads]
+            for g in gs:
+                g.to_device(cuda)
+            sgd.multi_update(ps, gs)
+            for p, g, s in zip(refs, grads, states):
+                np_sgd(p, g, s, **kwargs)
+        for p, ref in zip(ps, refs):
+            p.to_host()
+            np.testing.assert_allclose(tensor.to_numpy(p), ref, rtol=1e-4,
+                                       atol=1e-5)
+
+    def test_register_after_caching(self):
+        sgd = opt.SGD(lr=0.1, momentum=0.9)
+        config = dict(lr=0.2, momentum=0, dampening=0, weight_decay=0.1,
+                      nesterov=False)
+        configs = [dict(lr=0.1, momentum=0.9) for _ in range(4)]
+
+        def register(step, ps, configs):
+            if step == 2:
+                sgd.register([ps[0]], config)
+                configs[0] = config
+
+        self.check(sgd, configs, multi=True, on_step=register)
+
+    def test_first_grad_shape(self):
+        # the shape is checked for the params with and without momentum
+        for momentum in [0, 0.9]:
+            for multi in [False, True]:
+                sgd = opt.SGD(lr=0.1, momentum=momentum)
+                ps = [tensor.from_numpy(p) for p in self.params]
+                gs = [tensor.from_numpy(g) for g in self.grads[0]]
+                gs[1] = tensor.from_numpy(np.ones((4,), np.float32))
+                with self.assertRaises(AssertionError):
+                    if multi:
+                        sgd.multi_update(ps, gs)
+                    else:
+                        for p, g in zip(ps, gs):
+                            sgd.update(p, g)
+
+
+NCCL_ENV = ('NCCL_ALGO', 'NCCL_MIN_NCHANNELS')
+
+
+class StubCommunicator(object):
+    # records the all-reduce calls of a single process, which leaves the
+    # tensors unchanged; log records all the calls in order
+
+    def __init__(self, *args):
+        # the constructor arguments and the nccl settings of the environment
+        # when the communicator is created
+        self.args = args
+        self.env = {k: os.environ.get(k) for k in NCCL_ENV}
+        self.totalMPIRanksInGlobal = 1
+        self.MPIRankInLocal = 0
+        self.MPIRankInGlobal = 0
+        self.calls = []
+        self.log = []
+        # the result of the next overflow check
+        self.overflowed = False
+
+    def _synch(self, name, n):
+        self.calls.append((name, n))
+        self.log.append((name, n))
+        return len(self.calls) - 1
+
+    def synch(self, t, scale=1.0):
+        return self._synch('synch', 1)
+
+    def fusedSynch(self, t, scale=1.0):
+        return self._synch('fusedSynch', len(t))
+
+    def synchHalf(self, t, scale=1.0, lossScale=1.0):
+        return self._synch('synchHalf', 1)
+
+    def fusedSynchHalf(self, t, scale=1.0, lossScale=1.0):
+        return self._synch('fusedSynchHalf', len(t))
+
+    def synchSign(self, t, residual, scale=1.0):
+        return self._synch('synchSign', 1)
+
+    def fusedSynchSign(self, t, residual, scale=1.0):
+        return self._synch('fusedSynchSign', len(t))
+
+    def overflow(self):
+        self.log.append(('overflow',))
+        overflowed, self.overflowed = self.overflowed, False
+        return overflowed
+
+    def waitFor(self, idx):
+        self.log.append(('waitFor', idx))
+
+    def wait(self):
+        self.log.append(('wait',))
+
+    def groupStart(self):
+        self.log.append(('groupStart',))
+
+    def groupEnd(self):
+        self.log.append(('groupEnd',))
+
+
+def stub_dist_opt(sgd, world_size=1, **kwargs):
+    # DistOpt with a StubCommunicator in place of the nccl communicator
+    def create(*args):
+        communicator = StubCommunicator(*args)
+        communicator.totalMPIRanksInGlobal = world_size
+        return communicator
+
+    communicator = singa_wrap.Communicator
+    singa_wrap.Communicator = create
+    try:
+        return opt.DistOpt(sgd, **kwargs)
+    finally:
+        singa_wrap.Communicator = communicator
+
+
+class TestDistOpt(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        autograd.training = True
+        self.dev = device.get_default_device()
+        self.xs = [np.random.randn(8, 6).astype(np.float32) for _ in range(6)]
+        self.W = [np.random.randn(6, 6).astype(np.float32) * 0.3
+                  for _ in range(3)]
+        # the nccl settings of the process and the environment are reset, as
+        # DistOpt is created with a stub communicator many times
+        self.nccl_min_nchannels = opt._nccl_min_nchannels
+        opt._nccl_min_nchannels = None
+        self.env = {k: os.environ.pop(k, None) for k in NCCL_ENV}
+
+    def tearDown(self):
+        opt._nccl_min_nchannels = self.nccl_min_nchannels
+        for k, v in self.env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+
+    def test_init_algo(self):
+        with self.assertRaises(ValueError):
+            stub_dist_opt(opt.SGD(lr=0.1), algo='rings')
+        with self.assertRaises(ValueError):
+            stub_dist_opt(opt.SGD(lr=0.1), compression='2bit')
+        # the settings are only in the environment of the communicator
+        os.environ['NCCL_ALGO'] = 'Tree'
+        dist = stub_dist_opt(opt.SGD(lr=0.1), buffSize=1024, algo='ring',
+                             nchannels=4)
+        self.assertEqual(dist.communicator.args, (1024, False))
+        self.assertEqual(dist.communicator.env,
+                         {'NCCL_ALGO': 'Ring', 'NCCL_MIN_NCHANNELS': '4'})
+        self.assertEqual(os.environ['NCCL_ALGO'], 'Tree')
+        self.assertNotIn('NCCL_MIN_NCHANNELS', os.environ)
+        dist = stub_dist_opt(opt.SGD(lr=0.1), nchannels=4)
+        self.assertEqual(dist.communicator.env,
+                         {'NCCL_ALGO': 'Tree', 'NCCL_MIN_NCHANNELS': '4'})
+
+    def test_nchannels_warning(self):
+        # nccl reads NCCL_MIN_NCHANNELS once per process, i.e., the value of
+        # the first DistOpt is kept
+        for nchannels, warned in [(4, False), (4, False), (8, True),
+                                  (None, True)]:
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                stub_dist_opt(opt.SGD(lr=0.1), nchannels=nchannels)
+            self.assertEqual(len(w), int(warned))
+        self.assertEqual(opt._nccl_min_nchannels, ('4',))
+
+    def test_init_hierarchical(self):
+        with self.assertRaises(ValueError):
+            stub_dist_opt(opt.SGD(lr=0.1), nccl_id=object(), gpu_num=0,
+                          gpu_per_node=1, hierarchical=True)
+        dist = stub_dist_opt(opt.SGD(lr=0.1), buffSize=1024,
+                             hierarchical=True)
+        self.assertEqual(dist.communicator.args, (1024, True))
+        nccl_id = object()
+        dist = stub_dist_opt(opt.SGD(lr=0.1), nccl_id=nccl_id, gpu_num=1,
+                             gpu_per_node=2, buffSize=1024)
+        self.assertEqual(dist.communicator.args, (1, 2, nccl_id, 1024))
+
+    def test_init_sign_ranks(self):
+        # the int8 sum of the signs is limited to 127 ranks
+        dist = stub_dist_opt(opt.SGD(lr=0.1), world_size=127,
+                             compression='1bit')
+        self.assertEqual(dist.world_size, 127)
+        with self.assertRaises(ValueError):
+            stub_dist_opt(opt.SGD(lr=0.1), world_size=128, compression='1bit')
+        dist = stub_dist_opt(opt.SGD(lr=0.1), world_size=128)
+        self.assertEqual(dist.world_size, 128)
+
+    def model(self):
+        layers = []
+        for w in self.W:
+            fc = autograd.Linear(6, 6)
+            fc.W.copy_from_numpy(w.copy())
+            fc.b.set_value(0.1)
+            layers.append(fc)
+        return layers
+
+    def loss(self, layers, x):
+        y = tensor.from_numpy(x)
+        for fc in layers:
+            y = autograd.relu(fc(y))
+        t = tensor.Tensor((8, 6), self.dev)
+        t.set_value(0.5)
+        return autograd.mse_loss(y, t)
+
+    def assert_same_params(self, layers1, layers2):
+        for fc1, fc2 in zip(layers1, layers2):
+            for p1, p2 in [(fc1.W, fc2.W), (fc1.b, fc2.b)]:
+                np.testing.assert_allclose(tensor.to_numpy(p1),
+                                           tensor.to_numpy(p2), rtol=1e-5,
+                                           atol=1e-6)
+
+    def test_accumulate_steps(self):
+        steps = 3
+        ref = self.model()
+        sgd = opt.SGD(lr=0.1, momentum=0.9, weight_decay=0.01)
+        for i in range(0, len(self.xs), steps):
+            # update with the mean of the gradients of the steps
+            acc = {}
+            for x in self.xs[i:i + steps]:
+                for p, g in autograd.backward(self.loss(ref, x)):
+                    acc[p] = tensor.to_numpy(g) + acc.get(p, 0)
+            for p, g in acc.items():
+                sgd.update(p, tensor.from_numpy(g / steps))
+
+        layers = self.model()
+        dist = stub_dist_opt(opt.SGD(lr=0.1, momentum=0.9, weight_decay=0.01))
+        for x in self.xs:
+            dist.backward_and_update(self.loss(layers, x), threshold=20,
+                                     accumulate_steps=steps)
+        self.assert_same_params(ref, layers)
+        self.assertEqual(dist._accum, {})
+        self.assertEqual(dist._accum_step, 0)
+
+    def grad_sizes(self, x):
+        # the gradient sizes in the order of the backward propagation
+        return [g.size() for _, g in autograd.backward(self.loss(self.model(),
+                                                                 x))]
+
+    def test_buckets(self):
+        threshold, first_threshold = 40, 10
+        sgd = opt.SGD(lr=0.1)
+        dist = stub_dist_opt(sgd)
+        log = dist.communicator.log
+        multi_update = sgd.multi_update
+
+        def update(params, grads, grad_scale=1.0):
+            log.append(('update', [p.size() for p in params]))
+            multi_update(params, grads, grad_scale)
+
+        sgd.multi_update = update
+        dist.backward_and_update(self.loss(self.model(), self.xs[0]),
+                                 threshold=threshold, dtype=tensor.float32,
+                                 first_threshold=first_threshold)
+        calls = dist.communicator.calls
+        n = len(calls)
+        self.assertGreater(n, 2)
+        # all the buckets are reduced first, and then the update of each
+        # bucket waits for its own all-reduce only
+        self.assertEqual(log[:n], calls)
+        self.assertEqual([c[0] for c in calls], ['fusedSynch'] * n)
+        self.assertEqual(log[n::2][:n], [('waitFor', i) for i in range(n)])
+        self.assertEqual(log[-1], ('wait',))
+        updates = log[n + 1:-1:2]
+        self.assertEqual([u[0] for u in updates], ['update'] * n)
+        sizes = [u[1] for u in updates]
+        self.assertEqual([len(s) for s in sizes], [c[1] for c in calls])
+        # the first bucket is closed as soon as it exceeds first_threshold,
+        # the later ones as soon as they exceed threshold
+        limits = [first_threshold] + [threshold] * (n - 1)
+        for i, (s, limit) in enumerate(zip(sizes, limits)):
+            self.assertLessEqual(sum(s[:-1]), limit)
+            if i < n - 1:
+                self.assertGreater(sum(s), limit)
+
+    def test_group(self):
+        threshold = 20
+        for dtype, synch, fused, group in [
+                (tensor.float32, 'synch', 'fusedSynch', True),
+                (tensor.float16, 'synchHalf', 'fusedSynchHalf', False)]:
+            dist = stub_dist_opt(opt.SGD(lr=0.1))
+            layers = self.model()
+            x = self.xs[0]
+            sizes = self.grad_sizes(x)
+            self.assertTrue(any(s > threshold for s in sizes))
+            dist.backward_and_update(self.loss(layers, x), threshold=threshold,
+                                     dtype=dtype, first_threshold=threshold)
+            # each run of large float32 gradients is one nccl group, which is
+            # closed by the next small gradient before the fused bucket is
+            # reduced; the float16 all-reduces are not grouped
+            expected = []
+            grouped = False
+            acc = n = 0
+            for s in sizes:
+                if s > threshold:
+                    if group and not grouped:
+                        expected.append(('groupStart',))
+                        grouped = True
+                    expected.append((synch, 1))
+                else:
+                    if grouped:
+                        expected.append(('groupEnd',))
+                        grouped = False
+                    acc += s
+                    n += 1
+                    if acc > threshold:
+                        expected.append((fused, n))
+                        acc = n = 0
+            if grouped:
+                expected.append(('groupEnd',))
+            if n:
+                expected.append((fused, n))
+            log = [c for c in dist.communicator.log
+                   if c[0] in ('groupStart', 'groupEnd', synch, fused)]
+            self.assertEqual(log, expected)
+
+    def test_sign_residuals(self):
+        ref = self.model()
+        sgd = opt.SGD(lr=0.1)
+        layers = self.model()
+        dist = stub_dist_opt(opt.SGD(lr=0.1), compression='1bit')
+        params = [p for fc in layers for p in (fc.W, fc.b)]
+        for threshold in [20, 50]:
+            residuals = None
+            for x in self.xs[:3]:
+                for p, g in autograd.backward(self.loss(ref, x)):
+                    sgd.update(p, g)
+                dist.communicator.calls = []
+                dist.backward_and_update(self.loss(layers, x),
+                                         threshold=threshold,
+                                         first_threshold=threshold)
+                # one residual per sign all-reduce, keyed by the params of
+                # its bucket
+                calls = dist.communicator.calls
+                self.assertTrue(all(name in ('synchSign', 'fusedSynchSign')
+                                    for name, _ in calls))
+                self.assertEqual(len(dist._residuals), len(calls))
+                self.assertEqual(sorted(id(p) for key in dist._residuals
+                                        for p in dist._residuals[key][0]),
+                                 sorted(id(p) for p in params))
+                for key, (ps, r) in dist._residuals.items():
+                    self.assertEqual(key, tuple(id(p) for p in ps))
+                    self.assertEqual(r.size(), sum(p.size() for p in ps))
+                if residuals is None:
+                    # the residuals of a new layout start from zero
+                    for _, r in dist._residuals.values():
+                        np.testing.assert_array_equal(tensor.to_numpy(r), 0)
+                    residuals = dict(dist._residuals)
+                else:
+                    # and are reused while the layout stays the same
+                    self.assertEqual(set(dist._residuals), set(residuals))
+                    for key, (_, r) in dist._residuals.items():
+                        self.assertIs(r, residuals[key][1])
+        self.assert_same_params(ref, layers)
+
+    def test_half_overflow(self):
+        # the step whose float16 sums overflow is skipped
+        ref = self.model()
+        sgd = opt.SGD(lr=0.1, momentum=0.9)
+        layers = self.model()
+        dist = stub_dist_opt(opt.SGD(lr=0.1, momentum=0.9))
+        for i, x in enumerate(self.xs):
+            overflowed = i % 2 == 0
+            if not overflowed:
+                for p, g in autograd.backward(self.loss(ref, x)):
+                    sgd.update(p, g)
+            dist.communicator.overflowed = overflowed
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                dist.backward_and_update(self.loss(layers, x), threshold=20,
+                                         dtype=tensor.float16)
+            # the skipped steps are reported
+            self.assertEqual(len(w), int(overflowed))
+            self.assertEqual(dist.loss_scale,
+                             1024.0 / 2**((i + 2) // 2))
+        self.assert_same_params(ref, layers)
+
+    def check_partitions(self, dist, threshold, params):
+        partitions = dist._partitions
+        self.assertEqual(sorted(id(p) for ps, _ in partitions for p in ps),
+                         sorted(id(p) for p in params))
+        for i, (ps, fused) in enumerate(partitions):
+            if fused:
+                self.assertTrue(all(p.size() <= threshold for p in ps))
+                if i < len(partitions) - 1:
+                    self.assertGreater(sum(p.size() for p in ps), threshold)
+            else:
+                self.assertEqual(len(ps), 1)
+                self.assertGreater(ps[0].size(), threshold)
+        # one all-reduce call per partition
+        return [('fusedSynch', len(ps)) if fused else ('synch', 1)
+                for ps, fused in partitions]
+
+    def test_partial_update(self):
+        ref = self.model()
+        sgd = opt.SGD(lr=0.1)
+        layers = self.model()
+        dist = stub_dist_opt(opt.SGD(lr=0.1))
+        params = [p for fc in layers for p in (fc.W, fc.b)]
+        for threshold in [20, 50]:
+            expected = []
+            for x in self.xs:
+                for p, g in autograd.backward(self.loss(ref, x)):
+                    sgd.update(p, g)
+                dist.backward_and_partial_update(self.loss(layers, x),
+                                                 threshold)
+                if not expected:
+                    # the partitions are built in the first call
+                    expected = self.check_partitions(dist, threshold, params)
+            self.assert_same_params(ref, layers)
+            # the partitions are reduced in turn, starting from the first
+            # one after the threshold has changed
+            calls = dist.communicator.calls
+            self.assertEqual(calls, [expected[i % len(expected)]
+                                     for i in range(len(self.xs))])
+            dist.communicator.calls = []
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+/************************************************************
+*
+* Licensed to the Apache Software Foundation (ASF) under one
+* or more contributor license agreements.  See the NOTICE file
+* distributed with this work for additional information
+* regarding copyright ownership.  The ASF licenses this file
+* to you under the Apache License, Version 2.0 (the
+* "License"); you may not use this file except in compliance
+* with the License.  You may obtain a copy of the License at
+*
+*   http://www.apache.org/licenses/LICENSE-2.0
+*
+* Unless required by applicable law or agreed to in writing,
+* software distributed under the License is distributed on an
+* "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+* KIND, either express or implied.  See the License for the
+* specific language governing permissions and limitations
+* under the License.
+*
+*************************************************************/
+
+#include <algorithm>
+#include <cmath>
+
+#include "gtest/gtest.h"
+#include "singa/singa_config.h"
+#include "singa/io/communicator.h"
+
+#ifdef USE_DIST
+using singa::Tensor;
+using singa::Shape;
+
+TEST(Communicator, SynchSignChunks) {
+  // a single rank without MPI, whose sign buffers hold 2 * maxSize values,
+  // hence the tensor is reduced in 3 chunks, each with its own scale
+  const int maxSize = 4;
+  const size_t n = 19, chunk = 2 * maxSize;
+  singa::NcclIdHolder holder;
+  singa::Communicator comm(0, 1, holder, maxSize);
+  auto dev = std::make_shared<singa::CudaGPU>();
+
+  float in[n], res[n];
+  for (size_t i = 0; i < n; i++) {
+    in[i] = (i % 5) - 2.0f + 0.25f * i;
+    res[i] = 0.1f * (i % 3);
+  }
+  Tensor x(Shape{n}, dev), r(Shape{n}, dev);
+  x.CopyDataFromHostPtr<float>(in, n);
+  r.CopyDataFromHostPtr<float>(res, n);
+  comm.synchSign(x, r, 0.5f);
+  comm.wait();
+  cudaDeviceSynchronize();
+  x.ToHost();
+  r.ToHost();
+  const float *xptr = x.data<float>();
+  const float *rptr = r.data<float>();
+
+  for (size_t offset = 0; offset < n; offset += chunk) {
+    size_t end = std::min(n, offset + chunk);
+    float mean = 0.0f;
+    for (size_t i = offset; i < end; i++)
+      mean += fabs(in[i] + res[i]) / (end - offset);
+    for (size_t i = offset; i < end; i++) {
+      float e = in[i] + res[i];
+      float sign = e >= 0.0f ? 1.0f : -1.0f;
+      EXPECT_NEAR(e - mean * sign, rptr[i], 1e-5);
+      EXPECT_NEAR(0.5f * mean * sign, xptr[i], 1e-5);
+    }
+  }
+}
+
+TEST(Communicator, FusedSynchCarry) {
+  // the fused buffer is filled and scattered back by multi_tensor_copy, whose
+  // launches hold 320 chunks of 65536 values; the chunks of the large tensor
+  // beyond them are carried over to the next launch
+  const size_t sizes[3] = {5, 321 * 65536 + 7, 3};
+  const int maxSize = sizes[0] + sizes[1] + sizes[2];
+  singa::NcclIdHolder holder;
+  singa::Communicator comm(0, 1, holder, maxSize);
+  auto dev = std::make_shared<singa::CudaGPU>();
+
+  vector<Tensor> ts;
+  vector<vector<float>> dats;
+  for (size_t i = 0; i < 3; i++) {
+    Tensor t(Shape{sizes[i]}, dev);
+    vector<float> dat(sizes[i]);
+    for (size_t j = 0; j < sizes[i]; j++) dat[j] = i + 0.001f * (j % 1000);
+    t.CopyDataFromHostPtr<float>(dat.data(), sizes[i]);
+    ts.push_back(t);
+    dats.push_back(dat);
+  }
+  comm.fusedSynch(ts, 0.5f);
+  comm.wait();
+  cudaDeviceSynchronize();
+  for (size_t i = 0; i < 3; i++) {
+    ts[i].ToHost();
+    const float *tptr = ts[i].data<float>();
+    size_t wrong = 0;
+    for (size_t j = 0; j < sizes[i]; j++)
+      if (fabs(0.5f * dats[i][j] - tptr[j]) > 1e-5) wrong++;
+    EXPECT_EQ(0u, wrong);
+  }
+}
+#endif  // USE_DIST
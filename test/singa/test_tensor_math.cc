@@ -18,6 +18,9 @@
 
 #include "gtest/gtest.h"
 #include "singa/core/tensor.h"
+#ifdef USE_CUDA
+#include "../src/core/tensor/math_kernel.h"
+#endif
 using singa::Tensor;
 using singa::Shape;
 using singa::Device;
@@ -302,6 +305,96 @@ TEST_F(TensorMath, DivCpp) {
   EXPECT_NEAR(3.0 / 8.0, dptr3[2], 1e-5);
 }
 
+TEST_F(TensorMath, AxpbyCpp) {
+  Tensor y = b.Clone();
+  Axpby(2.0f, a, 0.5f, &y);
+  const float *yptr = y.data<float>();
+  for (size_t i = 0; i < 6; i++)
+    EXPECT_NEAR(2.0f * dat1[i] + 0.5f * dat2[i], yptr[i], 1e-5);
+
+  Axpby(3.0f, a, 0.0f, &y);
+  yptr = y.data<float>();
+  for (size_t i = 0; i < 6; i++) EXPECT_NEAR(3.0f * dat1[i], yptr[i], 1e-5);
+}
+
+TEST_F(TensorMath, FusedSGDUpdateCpp) {
+  // a is the param, b is the grad
+  Tensor buf(a.shape());
+  buf.SetValue(0.5f);
+  FusedSGDUpdate(&a, b, &buf, 0.1f, 0.9f, 0.0f, 0.01f, false, false);
+  const float *aptr = a.data<float>();
+  const float *bufptr = buf.data<float>();
+  for (size_t i = 0; i < 6; i++) {
+    float g = dat2[i] + 0.01f * dat1[i];
+    float v = 0.9f * 0.5f + g;
+    EXPECT_NEAR(v, bufptr[i], 1e-5);
+    EXPECT_NEAR(dat1[i] - 0.1f * v, aptr[i], 1e-5);
+  }
+}
+
+TEST_F(TensorMath, FusedSGDUpdateNesterovCpp) {
+  Tensor buf(a.shape());
+  buf.SetValue(0.5f);
+  FusedSGDUpdate(&a, b, &buf, 0.1f, 0.9f, 0.0f, 0.0f, true, false);
+  const float *aptr = a.data<float>();
+  const float *bufptr = buf.data<float>();
+  for (size_t i = 0; i < 6; i++) {
+    float v = 0.9f * 0.5f + dat2[i];
+    EXPECT_NEAR(v, bufptr[i], 1e-5);
+    EXPECT_NEAR(dat1[i] - 0.1f * (dat2[i] + 0.9f * v), aptr[i], 1e-5);
+  }
+}
+
+TEST_F(TensorMath, FusedSGDUpdateFirstStepCpp) {
+  // buf is not initialized and is set to the gradient
+  Tensor buf(a.shape());
+  FusedSGDUpdate(&a, b, &buf, 0.1f, 0.9f, 0.5f, 0.0f, false, true);
+  const float *aptr = a.data<float>();
+  const float *bufptr = buf.data<float>();
+  for (size_t i = 0; i < 6; i++) {
+    EXPECT_NEAR(dat2[i], bufptr[i], 1e-5);
+    EXPECT_NEAR(dat1[i] - 0.1f * dat2[i], aptr[i], 1e-5);
+  }
+}
+
+TEST_F(TensorMath, MultiTensorSGDCpp) {
+  vector<Tensor> params{a, e};
+  vector<Tensor> grads{b, b};
+  Tensor buf1(a.shape()), buf2(e.shape());
+  buf1.SetValue(0.0f);
+  buf2.SetValue(1.0f);
+  vector<Tensor> bufs{buf1, buf2};
+  vector<float> lrs{0.1f, 0.1f}, momenta{0.9f, 0.9f}, zeros{0.0f, 0.0f};
+  MultiTensorSGD(params, grads, bufs, lrs, momenta, zeros, zeros, false, false);
+  const float *aptr = a.data<float>();
+  const float *eptr = e.data<float>();
+  for (size_t i = 0; i < 6; i++) {
+    EXPECT_NEAR(dat1[i] - 0.1f * dat2[i], aptr[i], 1e-5);
+    EXPECT_NEAR(dat1[i] - 0.1f * (0.9f + dat2[i]), eptr[i], 1e-5);
+  }
+}
+
+TEST_F(TensorMath, MultiTensorSGDPerTensorCpp) {
+  // a uses momentum and its buffer; e uses weight decay and no buffer
+  vector<Tensor> params{a, e};
+  vector<Tensor> grads{b, b};
+  Tensor buf(a.shape());
+  buf.SetValue(1.0f);
+  vector<Tensor> bufs{buf, e};
+  vector<float> lrs{0.1f, 0.2f}, momenta{0.9f, 0.0f}, dampenings{0.0f, 0.0f},
+      weight_decays{0.0f, 0.5f};
+  MultiTensorSGD(params, grads, bufs, lrs, momenta, dampenings, weight_decays,
+                 false, false);
+  const float *aptr = a.data<float>();
+  const float *eptr = e.data<float>();
+  const float *bufptr = buf.data<float>();
+  for (size_t i = 0; i < 6; i++) {
+    EXPECT_NEAR(0.9f + dat2[i], bufptr[i], 1e-5);
+    EXPECT_NEAR(dat1[i] - 0.1f * (0.9f + dat2[i]), aptr[i], 1e-5);
+    EXPECT_NEAR(dat1[i] - 0.2f * (dat2[i] + 0.5f * dat1[i]), eptr[i], 1e-5);
+  }
+}
+
 TEST_F(TensorMath, BernoulliCpp) {
   Tensor p1(Shape{10000});
   Bernoulli(0.3f, &p1);
@@ -1227,6 +1320,139 @@ TEST_F(TensorMath, BroadcastCuda) {
   }
 }
 
+TEST_F(TensorMath, AxpbyCuda) {
+  auto dev = std::make_shared<singa::CudaGPU>();
+  a.ToDevice(dev);
+  b.ToDevice(dev);
+  Axpby(2.0f, a, 0.5f, &b);
+  b.ToHost();
+  const float *bptr = b.data<float>();
+  for (size_t i = 0; i < 6; i++)
+    EXPECT_NEAR(2.0f * dat1[i] + 0.5f * dat2[i], bptr[i], 1e-5);
+}
+
+TEST_F(TensorMath, FusedSGDUpdateCuda) {
+  auto dev = std::make_shared<singa::CudaGPU>();
+  a.ToDevice(dev);
+  b.ToDevice(dev);
+  Tensor buf(a.shape(), dev);
+  buf.SetValue(0.5f);
+  FusedSGDUpdate(&a, b, &buf, 0.1f, 0.9f, 0.1f, 0.01f, false, false);
+  a.ToHost();
+  buf.ToHost();
+  const float *aptr = a.data<float>();
+  const float *bufptr = buf.data<float>();
+  for (size_t i = 0; i < 6; i++) {
+    float g = dat2[i] + 0.01f * dat1[i];
+    float v = 0.9f * 0.5f + 0.9f * g;
+    EXPECT_NEAR(v, bufptr[i], 1e-5);
+    EXPECT_NEAR(dat1[i] - 0.1f * v, aptr[i], 1e-5);
+  }
+}
+
+TEST_F(TensorMath, MultiTensorSGDCuda) {
+  auto dev = std::make_shared<singa::CudaGPU>();
+  // more tensors than a single launch can hold and a multi-chunk tensor
+  const size_t n = 50, large = 200000;
+  vector<Tensor> params, grads, bufs;
+  for (size_t i = 0; i < n; i++) {
+    size_t size = i == n / 2 ? large : i + 1;
+    Tensor p(Shape{size}, dev), g(Shape{size}, dev), v(Shape{size}, dev);
+    p.SetValue(1.0f);
+    g.SetValue(0.5f);
+    v.SetValue(0.0f);
+    params.push_back(p);
+    grads.push_back(g);
+    bufs.push_back(v);
+  }
+  vector<float> lrs(n, 0.1f), momenta(n, 0.9f), zeros(n, 0.0f);
+  MultiTensorSGD(params, grads, bufs, lrs, momenta, zeros, zeros, false,
+                 false);
+  for (auto& p : params) {
+    p.ToHost();
+    const float *pptr = p.data<float>();
+    for (size_t j = 0; j < p.Size(); j++)
+      EXPECT_NEAR(1.0f - 0.1f * 0.5f, pptr[j], 1e-5);
+  }
+}
+
+TEST_F(TensorMath, MultiTensorSGDCarryCuda) {
+  auto dev = std::make_shared<singa::CudaGPU>();
+  // the large tensor has more chunks (of 65536 values) than the 320 blocks of
+  // a launch, hence its remaining chunks are carried over to the next launch
+  const size_t sizes[3] = {5, 321 * 65536 + 7, 3};
+  vector<Tensor> params, grads, bufs;
+  vector<vector<float>> gs;
+  for (size_t size : sizes) {
+    Tensor p(Shape{size}, dev), g(Shape{size}, dev), v(Shape{size}, dev);
+    vector<float> gdat(size);
+    for (size_t j = 0; j < size; j++) gdat[j] = 0.001f * (j % 1000);
+    p.SetValue(1.0f);
+    g.CopyDataFromHostPtr<float>(gdat.data(), size);
+    v.SetValue(0.0f);
+    params.push_back(p);
+    grads.push_back(g);
+    bufs.push_back(v);
+    gs.push_back(gdat);
+  }
+  vector<float> lrs = {0.1f, 0.2f, 0.3f}, momenta(3, 0.9f), zeros(3, 0.0f);
+  MultiTensorSGD(params, grads, bufs, lrs, momenta, zeros, zeros, false,
+                 false);
+  for (size_t i = 0; i < 3; i++) {
+    params[i].ToHost();
+    const float *pptr = params[i].data<float>();
+    size_t wrong = 0;
+    for (size_t j = 0; j < sizes[i]; j++)
+      if (fabs(1.0f - lrs[i] * gs[i][j] - pptr[j]) > 1e-5) wrong++;
+    EXPECT_EQ(0u, wrong);
+  }
+}
+
+TEST_F(TensorMath, SignCompressCuda) {
+  auto dev = std::make_shared<singa::CudaGPU>();
+  const size_t n = 6;
+  const float in[n] = {1.0f, -2.0f, 0.5f, 3.0f, -0.5f, -1.0f};
+  const float res[n] = {0.5f, 0.5f, -0.5f, -1.0f, 0.0f, 0.5f};
+  Tensor x(Shape{n}, dev), r(Shape{n}, dev), y(Shape{n}, dev);
+  x.CopyDataFromHostPtr<float>(in, n);
+  r.CopyDataFromHostPtr<float>(res, n);
+  int8_t *signs;
+  float *abs_sum;
+  cudaMalloc(&signs, n * sizeof(int8_t));
+  cudaMalloc(&abs_sum, sizeof(float));
+  float *xptr = static_cast<float *>(x.block()->mutable_data());
+  float *rptr = static_cast<float *>(r.block()->mutable_data());
+  float *yptr = static_cast<float *>(y.block()->mutable_data());
+  singa::cuda::sign_compress(n, xptr, rptr, signs, abs_sum, 0);
+  singa::cuda::sign_decompress(n, signs, abs_sum, 0.5f, yptr, 0);
+  cudaDeviceSynchronize();
+  int8_t hsigns[n];
+  cudaMemcpy(hsigns, signs, n * sizeof(int8_t), cudaMemcpyDeviceToHost);
+  cudaFree(signs);
+  cudaFree(abs_sum);
+  x.ToHost();
+  r.ToHost();
+  y.ToHost();
+  const float *xout = x.data<float>();
+  const float *rout = r.data<float>();
+  const float *yout = y.data<float>();
+
+  // in += residual, and the zero sum of in[2] and res[2] maps to +1
+  float e[n], mean = 0.0f;
+  for (size_t i = 0; i < n; i++) {
+    e[i] = in[i] + res[i];
+    mean += fabs(e[i]) / n;
+  }
+  EXPECT_EQ(0.0f, e[2]);
+  for (size_t i = 0; i < n; i++) {
+    int8_t sign = e[i] >= 0.0f ? 1 : -1;
+    EXPECT_NEAR(e[i], xout[i], 1e-5);
+    EXPECT_EQ(sign, hsigns[i]);
+    EXPECT_NEAR(e[i] - mean * sign, rout[i], 1e-5);
+    EXPECT_NEAR(0.5f * mean * sign, yout[i], 1e-5);
+  }
+}
+
 TEST_F(TensorMath, SoftPlusCuda) {
   auto dev = std::make_shared<singa::CudaGPU>();
   Tensor x(Shape{2}, dev);